@@ -4,7 +4,8 @@ django-bitfield
 """
 from __future__ import absolute_import
 
-from bitfield.models import Bit, BitHandler, CompositeBitField, BitField  # NOQA
+from bitfield.models import Bit, BitHandler, CompositeBitField, BitField, WideBitField  # NOQA
+from bitfield.query import BitCount  # NOQA
 
 default_app_config = 'bitfield.apps.BitFieldAppConfig'
 
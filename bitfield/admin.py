@@ -1,6 +1,7 @@
 import django
 
 from django.core.exceptions import ValidationError
+from django.db.models import Count, Q
 if django.VERSION < (2, 0):
     from django.utils.translation import ugettext_lazy as _
 else:
@@ -9,27 +10,69 @@ else:
 from django.contrib.admin import FieldListFilter
 from django.contrib.admin.options import IncorrectLookupParameters
 
-from bitfield import Bit, BitHandler
+from bitfield import Bit
+
+
+def _get_mask(value):
+    # Django 5.0+ passes every query string parameter as a list.
+    if isinstance(value, (list, tuple)):
+        value = value[-1] if value else 0
+    return int(value or 0)
+
+
+def flag_labels_column(field_name, description=None, separator=', '):
+    """
+    Return a ``list_display`` column rendering the labels of the flags set
+    in ``field_name``, through the field's memoized ``render_labels``::
+
+        list_display = ['name', flag_labels_column('flags')]
+    """
+    def column(obj):
+        field = obj._meta.get_field(field_name)
+        # The raw value spares building a handler for every row.
+        return field.render_labels(field.get_raw_value(obj), separator)
+
+    column.short_description = description or field_name.replace('_', ' ')
+    column.__name__ = '%s_labels' % field_name
+    return column
 
 
 class BitFieldListFilter(FieldListFilter):
     """
     BitField list filter.
+
+    Several flags can be selected at once; rows must have all of them set
+    (``?flags=<mask>``) or any of them (``?flags__has_any=<mask>``).  Each
+    choice shows how many rows of the current changelist have that flag,
+    all computed with a single aggregate query.
+    On Django 5.0+ counts follow the ModelAdmin's ``show_facets`` setting;
+    on older versions they are shown when ``show_counts`` is true.
     """
+    show_counts = True
 
     def __init__(self, field, request, params, model, model_admin, field_path):
         self.lookup_kwarg = field_path
-        self.lookup_val = int(request.GET.get(self.lookup_kwarg, 0))
+        self.lookup_kwarg_any = '%s__has_any' % field_path
+        try:
+            self.lookup_val = _get_mask(request.GET.get(self.lookup_kwarg, 0))
+            self.lookup_val_any = _get_mask(request.GET.get(self.lookup_kwarg_any, 0))
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
         self.flags = field.flags
         self.labels = field.labels
         super(BitFieldListFilter, self).__init__(
             field, request, params, model, model_admin, field_path)
 
     def queryset(self, request, queryset):
-        filter_kwargs = dict(
-            (p, BitHandler(v, ()))
-            for p, v in self.used_parameters.items()
-        )
+        filter_kwargs = {}
+        try:
+            for p, v in self.used_parameters.items():
+                mask = _get_mask(v)
+                if mask:
+                    lookup = 'has_any' if p == self.lookup_kwarg_any else 'has_all'
+                    filter_kwargs['%s__%s' % (self.field_path, lookup)] = mask
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
         if not filter_kwargs:
             return queryset
         try:
@@ -38,18 +81,62 @@ class BitFieldListFilter(FieldListFilter):
             raise IncorrectLookupParameters(e)
 
     def expected_parameters(self):
-        return [self.lookup_kwarg]
+        return [self.lookup_kwarg, self.lookup_kwarg_any]
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return dict(
+            ('%s__c' % number, Count(pk_attname, filter=Q(**{self.field_path: Bit(number)})))
+            for number, flag in enumerate(self.flags)
+        )
+
+    def get_counts(self, cl):
+        """
+        Return the per-flag row counts of the changelist's current queryset,
+        keyed like ``get_facet_counts``.
+        """
+        return cl.queryset.aggregate(**self.get_facet_counts(cl.pk_attname, cl.queryset))
 
     def choices(self, cl):
+        any_mode = bool(self.lookup_val_any) and not self.lookup_val
+        selected_mask = self.lookup_val_any if any_mode else self.lookup_val
+        selected_kwarg = self.lookup_kwarg_any if any_mode else self.lookup_kwarg
+        other_kwarg = self.lookup_kwarg if any_mode else self.lookup_kwarg_any
+        counts = None
+        if getattr(cl, 'add_facets', self.show_counts):
+            counts = self.get_counts(cl)
+
         yield {
-            'selected': self.lookup_val == 0,
-            'query_string': cl.get_query_string({}, [self.lookup_kwarg]),
+            'selected': not selected_mask,
+            'query_string': cl.get_query_string({}, self.expected_parameters()),
             'display': _('All'),
         }
         for number, flag in enumerate(self.flags):
             bit_mask = Bit(number).mask
+            # Clicking a flag toggles it in the current selection.
+            new_mask = selected_mask ^ bit_mask
+            if new_mask:
+                query_string = cl.get_query_string({selected_kwarg: new_mask}, [other_kwarg])
+            else:
+                query_string = cl.get_query_string({}, self.expected_parameters())
+            display = self.labels[number]
+            if counts is not None:
+                display = '%s (%s)' % (display, counts['%s__c' % number])
+            yield {
+                'selected': bool(selected_mask & bit_mask),
+                'query_string': query_string,
+                'display': display,
+            }
+        if selected_mask & (selected_mask - 1):
+            # More than one flag is selected: offer to switch the match mode.
+            yield {
+                'selected': not any_mode,
+                'query_string': cl.get_query_string(
+                    {self.lookup_kwarg: selected_mask}, [self.lookup_kwarg_any]),
+                'display': _('Match all selected'),
+            }
             yield {
-                'selected': self.lookup_val == bit_mask,
-                'query_string': cl.get_query_string({self.lookup_kwarg: bit_mask}),
-                'display': self.labels[number],
+                'selected': any_mode,
+                'query_string': cl.get_query_string(
+                    {self.lookup_kwarg_any: selected_mask}, [self.lookup_kwarg]),
+                'display': _('Match any selected'),
             }
@@ -0,0 +1,88 @@
+"""
+Migration autodetector adding ``RemapBits`` operations.
+
+It is opt-in: use it from a ``makemigrations`` command of the project
+(Django 5.2+)::
+
+    from django.core.management.commands.makemigrations import Command as MakeMigrationsCommand
+
+    from bitfield.autodetector import BitFieldAutodetector
+
+
+    class Command(MakeMigrationsCommand):
+        autodetector = BitFieldAutodetector
+"""
+from __future__ import absolute_import
+
+import warnings
+
+import django
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.questioner import InteractiveMigrationQuestioner
+
+from bitfield.models import BitField
+from bitfield.operations import RemapBits, get_bit_permutation, get_flag_names, is_identity
+
+if django.VERSION < (5, 2):
+    warnings.warn(
+        'makemigrations ignores custom autodetectors before Django 5.2, RemapBits '
+        'operations are not autodetected and must be added by hand.', RuntimeWarning)
+
+
+def get_flag_rename_candidates(old_flags, new_flags):
+    """
+    Return ``(old_name, new_name)`` pairs of the flags replaced in place, the
+    old name being gone from ``new_flags`` and the new one absent from
+    ``old_flags``.
+    """
+    old_names, new_names = get_flag_names(old_flags), get_flag_names(new_flags)
+    return [
+        (old, new) for old, new in zip(old_names, new_names)
+        if old and new and old != new and old not in new_names and new not in old_names
+    ]
+
+
+class BitFieldAutodetector(MigrationAutodetector):
+    """
+    Follow the ``AlterField`` of every BitField whose flags moved or were
+    removed with a ``RemapBits`` rewriting the stored values.
+    """
+    def ask_flag_rename(self, model_name, field_name, old_flag, new_flag):
+        """
+        Return whether ``old_flag`` was renamed to ``new_flag``.  Flags are
+        never assumed renamed without asking: a removed flag's bits would
+        otherwise carry over to an unrelated new flag.
+        """
+        if isinstance(self.questioner, InteractiveMigrationQuestioner):
+            return self.questioner._boolean_input(
+                'Was flag %s of %s.%s renamed to %s? [y/N]' % (
+                    old_flag, model_name, field_name, new_flag), False)
+        return self.questioner.defaults.get('ask_rename_flag', False)
+
+    def generate_altered_fields(self):
+        super(BitFieldAutodetector, self).generate_altered_fields()
+        for app_label, model_name, field_name in sorted(self.old_field_keys & self.new_field_keys):
+            old_model_name = self.renamed_models.get((app_label, model_name), model_name)
+            old_field_name = self.renamed_fields.get(
+                (app_label, model_name, field_name), field_name)
+            old_field = self.from_state.models[app_label, old_model_name].get_field(
+                old_field_name)
+            new_field = self.to_state.models[app_label, model_name].get_field(field_name)
+            if not (isinstance(old_field, BitField) and isinstance(new_field, BitField)):
+                continue
+            renames = dict(
+                (old, new)
+                for old, new in get_flag_rename_candidates(old_field.flags, new_field.flags)
+                if self.ask_flag_rename(model_name, field_name, old, new)
+            )
+            permutation = get_bit_permutation(old_field.flags, new_field.flags, renames)
+            if is_identity(permutation, old_field.flags):
+                continue
+            # Added after the field's AlterField, which it stays behind.
+            self.add_operation(app_label, RemapBits(
+                model_name=model_name,
+                name=field_name,
+                old_flags=list(old_field.flags),
+                new_flags=list(new_field.flags),
+                renames=renames,
+            ))
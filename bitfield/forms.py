@@ -41,7 +41,7 @@ class BitFormField(IntegerField):
         if isinstance(kwargs['initial'], int):
             iv = kwargs['initial']
             iv_list = []
-            for i in range(0, min(len(choices), 63)):
+            for i in range(0, len(choices)):
                 if (1 << i) & iv > 0:
                     iv_list += [choices[i][0]]
             kwargs['initial'] = iv_list
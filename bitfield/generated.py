@@ -0,0 +1,47 @@
+"""
+Database generated boolean columns mirroring single flags (Django 5.0+).
+"""
+from __future__ import absolute_import
+
+from django.db.models import BooleanField, GeneratedField
+from django.db.models.lookups import GreaterThan
+
+from bitfield.query import BitFlagExpression
+
+
+class MaterializedFlagField(GeneratedField):
+    """
+    A stored, indexed boolean column computed by the database as
+    ``(<bit_field> & mask) > 0``.
+
+    ``BitField(materialized=...)`` adds one per listed flag and lookups on
+    those flags are compiled against it.  It is also what migrations record,
+    so the field skips itself when the ``BitField`` already added it.
+    """
+    def __init__(self, bit_field, number, **kwargs):
+        self.bit_field = bit_field
+        self.number = number
+        kwargs.setdefault('db_index', True)
+        super(MaterializedFlagField, self).__init__(
+            expression=GreaterThan(BitFlagExpression(bit_field, 1 << number), 0),
+            output_field=BooleanField(),
+            db_persist=True,
+            **kwargs
+        )
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        if any(f.name == name for f in cls._meta.local_fields):
+            return
+        super(MaterializedFlagField, self).contribute_to_class(cls, name, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(MaterializedFlagField, self).deconstruct()
+        del kwargs['expression']
+        del kwargs['output_field']
+        del kwargs['db_persist']
+        if kwargs.get('db_index'):
+            del kwargs['db_index']
+        else:
+            kwargs['db_index'] = False
+        args[:0] = [self.bit_field, self.number]
+        return name, path, args, kwargs
@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+
+from django.db.backends.utils import names_digest, split_identifier
+from django.db.models import F, Index, Q
+
+from bitfield.query import BitFlagExpression
+from bitfield.types import Bit
+
+
+class BitFlagIndex(Index):
+    """
+    Expression index on a single flag of a BitField::
+
+        class Meta:
+            indexes = [BitFlagIndex('flags', 'awesome_flag')]
+
+    This creates an index on ``(col & mask)``, which is exactly the
+    expression ``flags=Bit(n)``, ``flags=~Bit(n)`` and single flag
+    ``has_all``/``has_any``/``has_none`` lookups compare against zero, so the
+    database can serve those filters from the index.  Requires a database
+    supporting expression indexes (PostgreSQL, SQLite, MySQL 8.0.13+).
+    """
+    suffix = 'bit'
+
+    def __init__(self, field, flag, name=None, db_tablespace=None):
+        if isinstance(flag, Bit):
+            flag = flag.number
+        self.field_name = field
+        self.flag = flag
+        # Index insists on a name for expression indexes; ours is generated
+        # from the model in set_name_with_model() when not given.
+        super(BitFlagIndex, self).__init__(
+            F(field), name=name or self.suffix, db_tablespace=db_tablespace)
+        self.name = name or ''
+
+    def get_bit_number(self, model):
+        if isinstance(self.flag, int):
+            return self.flag
+        field = model._meta.get_field(self.field_name)
+        try:
+            return field.schema.numbers[self.flag]
+        except KeyError:
+            raise ValueError('%s is not a valid flag' % self.flag)
+
+    def get_index_columns(self, model):
+        return []
+
+    def get_expression(self, model):
+        return BitFlagExpression(self.field_name, 1 << self.get_bit_number(model))
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        index = Index(
+            self.get_expression(model), name=self.name, db_tablespace=self.db_tablespace)
+        return index.create_sql(model, schema_editor, using=using, **kwargs)
+
+    def set_name_with_model(self, model):
+        _, table_name = split_identifier(model._meta.db_table)
+        column_name = model._meta.get_field(self.field_name).column
+        bit_number = str(self.get_bit_number(model))
+        hash_data = [table_name, column_name, bit_number, self.suffix]
+        hash_data.extend(self.get_index_columns(model))
+        self.name = '%s_%s_%s' % (
+            table_name[:11],
+            column_name[:7],
+            '%s_%s' % (names_digest(*hash_data, length=6), self.suffix),
+        )
+        if self.name[0] == '_' or self.name[0].isdigit():
+            self.name = 'D%s' % self.name[1:]
+
+    def deconstruct(self):
+        path = '%s.%s' % (self.__class__.__module__, self.__class__.__name__)
+        kwargs = {'field': self.field_name, 'flag': self.flag, 'name': self.name}
+        if self.db_tablespace is not None:
+            kwargs['db_tablespace'] = self.db_tablespace
+        return (path, (), kwargs)
+
+    def __repr__(self):
+        return '<%s: field=%r flag=%r name=%r>' % (
+            self.__class__.__name__, self.field_name, self.flag, self.name)
+
+
+class BitFlagPartialIndex(BitFlagIndex):
+    """
+    Partial index over ``fields`` (the primary key by default) of only the
+    rows having a given flag set::
+
+        class Meta:
+            indexes = [BitFlagPartialIndex('flags', 'is_spam')]
+
+    This suits sparse flags: the index holds only the few matching rows and
+    its ``WHERE (col & mask) > 0`` condition is the exact predicate
+    ``flags=Bit(n)`` and ``flags__has_any=[flag]`` compile to, which lets
+    PostgreSQL and SQLite use it for those filters.  Backends without partial
+    index support get a full index over ``fields``.
+    """
+    def __init__(self, field, flag, fields=(), name=None, db_tablespace=None):
+        super(BitFlagPartialIndex, self).__init__(
+            field, flag, name=name, db_tablespace=db_tablespace)
+        self.index_fields = list(fields)
+
+    def get_index_fields(self, model):
+        return self.index_fields or [model._meta.pk.name]
+
+    def get_index_columns(self, model):
+        return [
+            ('-%s' if f.startswith('-') else '%s') % model._meta.get_field(f.lstrip('-')).column
+            for f in self.get_index_fields(model)
+        ]
+
+    def get_condition(self, model):
+        return Q(**{self.field_name: Bit(self.get_bit_number(model))})
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        condition = None
+        if schema_editor.connection.features.supports_partial_indexes:
+            condition = self.get_condition(model)
+        index = Index(
+            fields=self.get_index_fields(model), condition=condition, name=self.name,
+            db_tablespace=self.db_tablespace)
+        return index.create_sql(model, schema_editor, using=using, **kwargs)
+
+    def deconstruct(self):
+        path, args, kwargs = super(BitFlagPartialIndex, self).deconstruct()
+        if self.index_fields:
+            kwargs['fields'] = self.index_fields
+        return path, args, kwargs
+
+    def __repr__(self):
+        return '<%s: field=%r flag=%r fields=%r name=%r>' % (
+            self.__class__.__name__, self.field_name, self.flag, self.index_fields, self.name)
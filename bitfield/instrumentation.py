@@ -0,0 +1,228 @@
+"""
+Opt-in counters and timings of bitfield's hot paths::
+
+    from bitfield import instrumentation
+
+    with instrumentation.instrumented() as stats:
+        render_the_page()
+    stats.counts['handlers'], stats.timings['to_python']
+
+``enable()`` wraps the instrumented methods and ``disable()`` restores them,
+so nothing is paid while instrumentation is off.  Calls nest: the methods
+are restored by the ``disable()`` matching the first ``enable()``.  Each
+thread counts on its own, ``snapshot()`` adds up all threads, finished ones
+included, and an ``instrumented()`` block only reports its own thread, e.g.
+its request.
+
+Counters:
+
+``to_python``
+    ``BitField.to_python`` calls, also timed.
+``handlers``
+    ``BitHandler`` instances built.
+``repairs``
+    Negative values repaired by ``BitField.to_int``.
+``bits``
+    ``Bit`` instances allocated, interned bits excepted.
+``lookups``
+    ``flags=Bit(n)`` lookups compiled by ``BitQueryLookupWrapper``, also
+    timed.
+"""
+from __future__ import absolute_import
+
+import functools
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from bitfield.models import BitField
+from bitfield.query import BitQueryLookupWrapper
+from bitfield.types import Bit, BitHandler
+
+COUNTERS = ('to_python', 'handlers', 'repairs', 'bits', 'lookups')
+TIMERS = ('to_python', 'lookups')
+
+# (counts, timings) of every running thread that counted something, by
+# id(counts).  Each thread only writes its own dicts, which hold every key
+# from the start so that they can be read from other threads.
+_thread_counters = {}
+# What finished threads counted.
+_finished = (dict.fromkeys(COUNTERS, 0), dict.fromkeys(TIMERS, 0.0))
+_local = threading.local()
+_originals = {}
+# enable() calls not matched by a disable() yet.
+_enabled = 0
+_lock = threading.Lock()
+
+
+class _ThreadCounters(list):
+    """
+    ``(counts, timings)`` of a thread, weakly referenceable.
+    """
+
+
+def _add(totals, counters):
+    for name in COUNTERS:
+        totals[0][name] += counters[0][name]
+    for name in TIMERS:
+        totals[1][name] += counters[1][name]
+
+
+def _fold(key):
+    # Called once the thread's local storage is freed.
+    with _lock:
+        _add(_finished, _thread_counters.pop(key))
+
+
+def _get_counters():
+    try:
+        return _local.counters
+    except AttributeError:
+        counts, timings = dict.fromkeys(COUNTERS, 0), dict.fromkeys(TIMERS, 0.0)
+        counters = _local.counters = _ThreadCounters([counts, timings])
+        with _lock:
+            _thread_counters[id(counts)] = (counts, timings)
+        weakref.finalize(counters, _fold, id(counts))
+        return counters
+
+
+def _counted(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _get_counters()[0][name] += 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _timed(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            counts, timings = _get_counters()
+            timings[name] += time.perf_counter() - start
+            counts[name] += 1
+    return wrapper
+
+
+def _counted_repairs(func):
+    @functools.wraps(func)
+    def wrapper(self, value):
+        raw = value.mask if isinstance(value, (BitHandler, Bit)) else value
+        if raw and int(raw) < 0:
+            _get_counters()[0]['repairs'] += 1
+        return func(self, value)
+    return wrapper
+
+
+def _counted_bits(func):
+    @functools.wraps(func)
+    def wrapper(cls, number, is_set):
+        _get_counters()[0]['bits'] += 1
+        return func(cls, number, is_set)
+    return classmethod(wrapper)
+
+
+# (owner, attribute, wrapper factory)
+_HOOKS = (
+    (BitField, 'to_python', lambda func: _timed(func, 'to_python')),
+    (BitField, 'to_int', _counted_repairs),
+    (BitHandler, '__init__', lambda func: _counted(func, 'handlers')),
+    (Bit, '_create', lambda method: _counted_bits(method.__func__)),
+    (BitQueryLookupWrapper, 'as_sql', lambda func: _timed(func, 'lookups')),
+)
+
+
+def is_enabled():
+    return _enabled > 0
+
+
+def enable():
+    """
+    Start counting.  Every call must be matched by a ``disable()``.
+    """
+    global _enabled
+    with _lock:
+        _enabled += 1
+        if _enabled > 1:
+            return
+        for owner, attr, wrap in _HOOKS:
+            original = owner.__dict__[attr]
+            _originals[owner, attr] = original
+            setattr(owner, attr, wrap(original))
+
+
+def disable():
+    """
+    Undo an ``enable()``.  The last one restores the uninstrumented methods.
+    """
+    global _enabled
+    with _lock:
+        if not _enabled:
+            return
+        _enabled -= 1
+        if _enabled:
+            return
+        for (owner, attr), original in _originals.items():
+            setattr(owner, attr, original)
+        _originals.clear()
+
+
+def _nonzero(values):
+    return dict((name, value) for name, value in values.items() if value)
+
+
+def snapshot():
+    """
+    Return ``{'counts': {...}, 'timings': {...}}`` of all threads, timings
+    being cumulative seconds.
+    """
+    counts, timings = dict.fromkeys(COUNTERS, 0), dict.fromkeys(TIMERS, 0.0)
+    with _lock:
+        _add((counts, timings), _finished)
+        for counters in _thread_counters.values():
+            _add((counts, timings), counters)
+    return {'counts': _nonzero(counts), 'timings': _nonzero(timings)}
+
+
+def reset():
+    with _lock:
+        for counts, timings in (_finished,) + tuple(_thread_counters.values()):
+            counts.update(dict.fromkeys(COUNTERS, 0))
+            timings.update(dict.fromkeys(TIMERS, 0.0))
+
+
+class Stats(object):
+    """
+    Counts and timings recorded within an ``instrumented()`` block.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self.counts)
+
+
+@contextmanager
+def instrumented():
+    """
+    Enable instrumentation for the duration of the block, e.g. a request,
+    and yield a ``Stats`` filled on exit with what the current thread
+    recorded within the block.
+    """
+    enable()
+    counts, timings = _get_counters()
+    before = dict(counts), dict(timings)
+    stats = Stats()
+    try:
+        yield stats
+    finally:
+        stats.counts = _nonzero(dict(
+            (name, value - before[0][name]) for name, value in counts.items()))
+        stats.timings = _nonzero(dict(
+            (name, value - before[1][name]) for name, value in timings.items()))
+        disable()
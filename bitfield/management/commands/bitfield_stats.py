@@ -0,0 +1,175 @@
+from __future__ import absolute_import
+
+import json
+import random
+from collections import Counter
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from bitfield.models import BitField
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class FlagStats(object):
+    """
+    Flag frequencies, pairwise co-occurrences and most common values of a
+    stream of flag values.
+
+    At most ``max_distinct`` distinct values are tracked for the top values;
+    past that the least common ones are dropped and those counts become
+    approximate.  Flag and pair counts are always exact.
+    """
+    def __init__(self, field, max_distinct):
+        self.field = field
+        self.max_distinct = max_distinct
+        self.rows = 0
+        self.flag_counts = [0] * len(field.flags)
+        self.pair_counts = Counter()
+        self.values = Counter()
+        self.approximate = False
+
+    def add_chunk(self, values):
+        chunk = Counter(self.field.to_int(value) for value in values)
+        self.rows += sum(chunk.values())
+        numbers = range(len(self.field.flags))
+        for value, count in chunk.items():
+            bits = [n for n in numbers if value >> n & 1]
+            for i, a in enumerate(bits):
+                self.flag_counts[a] += count
+                for b in bits[i + 1:]:
+                    self.pair_counts[a, b] += count
+        self.values.update(chunk)
+        if len(self.values) > self.max_distinct:
+            self.values = Counter(dict(self.values.most_common(self.max_distinct // 2)))
+            self.approximate = True
+
+    def as_dict(self, top):
+        flags = self.field.flags
+        return {
+            'rows': self.rows,
+            'flags': dict((flag, self.flag_counts[n]) for n, flag in enumerate(flags) if flag),
+            'pairs': [
+                [flags[a], flags[b], count]
+                for (a, b), count in self.pair_counts.most_common()
+            ],
+            'top_values': [
+                [value, count, list(self.field.get_set_labels(value))]
+                for value, count in self.values.most_common(top)
+            ],
+            'approximate_top_values': self.approximate,
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream the values of a BitField in primary key chunks and report '
+        'per-flag counts, pairwise co-occurrences and the most common values.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', metavar='app_label.ModelName')
+        parser.add_argument(
+            'field', nargs='?',
+            help='BitField to analyze, may be omitted when the model has only one.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='Primary keys per chunk (default: %d).' % DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='Number of most common values to report (default: 10).')
+        parser.add_argument(
+            '--sample', type=float, default=1.0,
+            help='Fraction of the table to read, between 0 and 1 (default: 1).')
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Random seed used for sampling.')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Output the statistics as JSON.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to read from.')
+
+    def get_field(self, model, field_name):
+        if field_name is not None:
+            field = model._meta.get_field(field_name)
+            if not isinstance(field, BitField):
+                raise CommandError('%s is not a BitField' % field_name)
+            return field
+        fields = [f for f in model._meta.concrete_fields if isinstance(f, BitField)]
+        if len(fields) != 1:
+            raise CommandError(
+                '%s has %d BitFields, pass the field name' % (model._meta.label, len(fields)))
+        return fields[0]
+
+    def iter_chunks(self, queryset, field, chunk_size, sample, rng):
+        """
+        Yield lists of the values of ``field``, one per chunk of
+        ``chunk_size`` consecutive primary keys.
+
+        The first key of the next chunk is read from the primary key index,
+        so sparse keys cost no empty queries.  Sampling skips whole chunks
+        without reading their rows, which are otherwise streamed with a
+        server-side cursor where the backend has them.
+        """
+        queryset = queryset.order_by('pk')
+        start = None
+        while True:
+            rows = queryset if start is None else queryset.filter(pk__gte=start)
+            following = list(rows.values_list('pk', flat=True)[chunk_size:chunk_size + 1])
+            if following:
+                rows = rows.filter(pk__lt=following[0])
+            if sample >= 1 or rng.random() < sample:
+                yield list(rows.values_list(field.attname, flat=True).iterator(chunk_size=chunk_size))
+            if not following:
+                return
+            start = following[0]
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+        field = self.get_field(model, options['field'])
+        sample = options['sample']
+        if not 0 < sample <= 1:
+            raise CommandError('--sample must be in (0, 1]')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        stats = FlagStats(field, max_distinct=max(10000, options['top'] * 10))
+        queryset = model._base_manager.using(options['database'])
+        rng = random.Random(options['seed'])
+        for values in self.iter_chunks(queryset, field, options['chunk_size'], sample, rng):
+            stats.add_chunk(values)
+
+        result = stats.as_dict(options['top'])
+        result.update({'model': model._meta.label, 'field': field.name, 'sample': sample})
+        if options['json']:
+            self.stdout.write(json.dumps(result, sort_keys=True))
+            return
+        self.write_report(result)
+
+    def write_report(self, result):
+        rows = result['rows']
+
+        def percent(count):
+            return 100.0 * count / rows if rows else 0.0
+
+        self.stdout.write('%s.%s: %d rows%s' % (
+            result['model'], result['field'], rows,
+            ' (%g%% sample)' % (100 * result['sample']) if result['sample'] < 1 else ''))
+        self.stdout.write('Flags:')
+        for flag, count in result['flags'].items():
+            self.stdout.write('  %-30s %10d %6.2f%%' % (flag, count, percent(count)))
+        self.stdout.write('Co-occurring flags:')
+        for a, b, count in result['pairs']:
+            self.stdout.write('  %-30s %10d %6.2f%%' % ('%s + %s' % (a, b), count, percent(count)))
+        self.stdout.write('Most common values%s:' % (
+            ' (approximate)' if result['approximate_top_values'] else ''))
+        for value, count, labels in result['top_values']:
+            self.stdout.write('  %-20d %10d %6.2f%%  %s' % (
+                value, count, percent(count), ', '.join(labels) or '-'))
@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router
+
+from bitfield.models import BitField
+from bitfield.types import Bit
+
+PG_ROWS_RE = re.compile(r'rows=(\d+)')
+
+
+def parse_plan(vendor, plan):
+    """
+    Return ``(full_scan, rows)`` for the ``EXPLAIN`` output ``plan``.
+
+    ``full_scan`` is ``None`` when the plan of this backend is not
+    understood and ``rows`` is ``None`` when it has no row estimate.
+    """
+    if vendor == 'sqlite':
+        # SEARCH seeks an index.  SCAN reads the whole table unless it is
+        # followed by USING (... INDEX), e.g. a partial index.
+        return bool(re.search(r'\bSCAN\b(?!.*\bUSING\b)', plan)), None
+    if vendor == 'postgresql':
+        match = PG_ROWS_RE.search(plan)
+        return 'Seq Scan' in plan, int(match.group(1)) if match else None
+    if vendor == 'mysql':
+        return bool(re.search(r'\bALL\b', plan)), None
+    return None, None
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN flags=Bit(n) and flags=~Bit(n) filters of every BitField, '
+        'report those running full scans and suggest indexes covering them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Only explain the BitFields of these models.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to run EXPLAIN against.')
+
+    def get_models(self, labels, using):
+        if labels:
+            try:
+                return [apps.get_model(label) for label in labels]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+        connection = connections[using]
+        return [
+            model for model in apps.get_models()
+            if not model._meta.proxy and model._meta.can_migrate(connection)
+            and router.allow_migrate_model(using, model)
+        ]
+
+    def handle(self, *args, **options):
+        using = options['database']
+        vendor = connections[using].vendor
+        for model in self.get_models(options['models'], using):
+            fields = [f for f in model._meta.concrete_fields if isinstance(f, BitField)]
+            suggestions = []
+            for field in fields:
+                self.stdout.write('%s.%s' % (model._meta.label, field.name))
+                for number, flag in enumerate(field.flags):
+                    if not flag:
+                        continue
+                    scans = []
+                    for is_set in (True, False):
+                        queryset = model._base_manager.using(using).filter(
+                            **{field.name: Bit(number, is_set)})
+                        try:
+                            plan = queryset.explain()
+                        except DatabaseError as e:
+                            self.stdout.write('  %-20s %-5s error: %s' % (
+                                flag, 'set' if is_set else 'unset', e))
+                            continue
+                        full_scan, rows = parse_plan(vendor, plan)
+                        scans.append(full_scan)
+                        self.stdout.write('  %-20s %-5s %-10s rows=%s' % (
+                            flag, 'set' if is_set else 'unset',
+                            {True: 'FULL SCAN', False: 'index', None: 'unknown'}[full_scan],
+                            '?' if rows is None else rows))
+                    if any(scans):
+                        suggestions.append("BitFlagIndex('%s', '%s')" % (field.name, flag))
+            if suggestions:
+                self.stdout.write('Suggested indexes for %s:' % model._meta.label)
+                self.stdout.write('    from bitfield.indexes import BitFlagIndex')
+                self.stdout.write('    indexes = [')
+                for suggestion in suggestions:
+                    self.stdout.write('        %s,' % suggestion)
+                self.stdout.write('    ]')
+                self.stdout.write(
+                    '    Sparse flags, only ever filtered as set, are better served by '
+                    'BitFlagPartialIndex.')
@@ -0,0 +1,33 @@
+from __future__ import absolute_import
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from bitfield.sidecar import get_sidecar_fields, rebuild_sidecar
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the sidecar tables of BitFields with indexed flags.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Only rebuild the sidecars of these models.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to rebuild the sidecars in.')
+
+    def handle(self, *args, **options):
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+        else:
+            models = apps.get_models()
+        for model in models:
+            for field in get_sidecar_fields(model):
+                rebuild_sidecar(field, using=options['database'])
+                self.stdout.write('Rebuilt %s (%s.%s)' % (
+                    field.sidecar._meta.db_table, model._meta.label, field.name))
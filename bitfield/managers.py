@@ -0,0 +1,192 @@
+from __future__ import absolute_import
+
+import copy
+
+from django.db import models, transaction
+
+from bitfield.models import BitField, CompositeBitField
+from bitfield.types import Bit
+from bitfield.query import BitUpdateExpression, get_flags_mask
+from bitfield.sidecar import get_sidecar_fields, sync_sidecar
+
+
+class BitQuerySet(models.QuerySet):
+    """
+    QuerySet with bulk flag operations for models with a ``BitField``.
+    """
+    def _get_bitfield(self, field_name=None):
+        if field_name is not None:
+            field = self.model._meta.get_field(field_name)
+            if not isinstance(field, BitField):
+                raise TypeError('%s is not a BitField' % field_name)
+            return field
+        fields = [f for f in self.model._meta.concrete_fields if isinstance(f, BitField)]
+        if len(fields) != 1:
+            raise TypeError(
+                '%s has %d BitFields, pass the field name explicitly'
+                % (self.model.__name__, len(fields)))
+        return fields[0]
+
+    def _rewrite_composite_lookups(self, args, kwargs):
+        """
+        Turn ``has_all``/``has_any``/``has_none`` lookups on a
+        ``CompositeBitField`` into lookups on its underlying BitFields.
+        """
+        composites = dict(
+            (f.name, f) for f in self.model._meta.private_fields
+            if isinstance(f, CompositeBitField))
+        if not composites:
+            return args, kwargs
+
+        def rewrite(key, value):
+            name, _, lookup = key.partition('__')
+            if name in composites:
+                return composites[name].get_q(lookup, value)
+            return None
+
+        def rewrite_q(q):
+            q = copy.copy(q)
+            children = []
+            for child in q.children:
+                if isinstance(child, models.Q):
+                    child = rewrite_q(child)
+                elif isinstance(child, tuple):
+                    child = rewrite(*child) or child
+                children.append(child)
+            q.children = children
+            return q
+
+        args = [rewrite_q(arg) if isinstance(arg, models.Q) else arg for arg in args]
+        new_kwargs = {}
+        for key, value in kwargs.items():
+            q = rewrite(key, value)
+            if q is None:
+                new_kwargs[key] = value
+            else:
+                args.append(q)
+        return args, new_kwargs
+
+    def filter(self, *args, **kwargs):
+        args, kwargs = self._rewrite_composite_lookups(args, kwargs)
+        return super(BitQuerySet, self).filter(*args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        args, kwargs = self._rewrite_composite_lookups(args, kwargs)
+        return super(BitQuerySet, self).exclude(*args, **kwargs)
+
+    def update(self, **kwargs):
+        fields = [f for f in get_sidecar_fields(self.model) if f.name in kwargs or f.attname in kwargs]
+        if not fields:
+            return super(BitQuerySet, self).update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Rows may stop matching the filter once updated.
+            pks = list(self.values_list('pk', flat=True))
+            rows = super(BitQuerySet, self).update(**kwargs)
+            for field in fields:
+                sync_sidecar(field, pks, using=self.db)
+        return rows
+
+    def _reset_changes(self, objs, fields=None):
+        # Bulk operations send no post_save, the saved changes must not be
+        # applied again by the next save().
+        for field in self.model._meta.concrete_fields:
+            if isinstance(field, BitField):
+                for obj in objs:
+                    field.reset_changes(obj, update_fields=fields)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(BitQuerySet, self).bulk_create(objs, *args, **kwargs)
+        self._reset_changes(objs)
+        pks = [obj.pk for obj in objs if obj.pk is not None]
+        for field in get_sidecar_fields(self.model):
+            sync_sidecar(field, pks, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        rows = super(BitQuerySet, self).bulk_update(objs, fields, *args, **kwargs)
+        self._reset_changes(objs, fields)
+        pks = [obj.pk for obj in objs]
+        for field in get_sidecar_fields(self.model):
+            if field.name in fields:
+                sync_sidecar(field, pks, using=self.db)
+        return rows
+
+    def _get_update_bits_expression(self, field, set, clear, toggle):
+        return BitUpdateExpression(
+            field.name,
+            set_mask=get_flags_mask(set, field.schema),
+            clear_mask=get_flags_mask(clear, field.schema),
+            toggle_mask=get_flags_mask(toggle, field.schema),
+        )
+
+    def update_bits(self, field=None, set=(), clear=(), toggle=()):
+        """
+        Set, clear and toggle flags of ``field`` in a single ``UPDATE``::
+
+            MyModel.objects.filter(...).update_bits(
+                'flags', set=['awesome_flag'], clear=[MyModel.flags.baz_bar])
+
+        Flags may be given as names, ``Bit``s or ``BitHandler``s.  The new
+        value is ``((col | set) & ~clear) ^ toggle``.  ``field`` may be
+        omitted when the model has a single ``BitField``.  Returns the number
+        of rows matched.
+        """
+        field = self._get_bitfield(field)
+        expression = self._get_update_bits_expression(field, set, clear, toggle)
+        return self.update(**{field.name: expression})
+
+    async def aupdate_bits(self, field=None, set=(), clear=(), toggle=()):
+        """
+        Asynchronous version of ``update_bits``.
+        """
+        field = self._get_bitfield(field)
+        expression = self._get_update_bits_expression(field, set, clear, toggle)
+        return await self.aupdate(**{field.name: expression})
+
+    def _get_flag_count_aggregates(self, field):
+        aggregates = {}
+        for flag, number in field.schema.numbers.items():
+            if not flag:
+                # Placeholder for an unused bit of a dict defined field.
+                continue
+            aggregates['bit_%d' % number] = models.Sum(models.Case(
+                models.When(**{field.name: Bit(number), 'then': 1}),
+                default=0,
+                output_field=models.IntegerField(),
+            ))
+        return aggregates
+
+    def _get_flag_counts(self, field, result, labels):
+        schema = field.schema
+        keys = schema.labels if labels else schema.keys
+        return dict(
+            (keys[schema.numbers[flag]], result['bit_%d' % schema.numbers[flag]] or 0)
+            for flag in schema.keys if flag
+        )
+
+    def flag_counts(self, field=None, labels=False):
+        """
+        Return a dict mapping each flag of ``field`` to the number of rows
+        having it set, computed in a single aggregate query::
+
+            >>> MyModel.objects.flag_counts('flags')
+            {'awesome_flag': 12, 'flaggy_foo': 0, 'baz_bar': 3}
+
+        Keys are flag labels instead of names when ``labels`` is true.
+        """
+        field = self._get_bitfield(field)
+        result = self.aggregate(**self._get_flag_count_aggregates(field))
+        return self._get_flag_counts(field, result, labels)
+
+    async def aflag_counts(self, field=None, labels=False):
+        """
+        Asynchronous version of ``flag_counts``.
+        """
+        field = self._get_bitfield(field)
+        result = await self.aaggregate(**self._get_flag_count_aggregates(field))
+        return self._get_flag_counts(field, result, labels)
+
+
+class BitManager(models.Manager.from_queryset(BitQuerySet)):
+    pass
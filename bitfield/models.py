@@ -1,20 +1,64 @@
-from django.db.models import signals
-from django.db.models.fields import Field, BigIntegerField
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q, signals
+from django.db.models.fields import Field, BigIntegerField, BinaryField
 
 from bitfield.forms import BitFormField
-from bitfield.query import BitQueryLookupWrapper
-from bitfield.types import BitHandler, Bit
+from bitfield.query import (
+    BitCount, BitQueryLookupWrapper, BitHasAllLookup, BitUpdateExpression, BitHasAnyLookup, BitHasNoneLookup,
+    WideBitQueryLookupWrapper, WideBitHasAllLookup, WideBitHasAnyLookup, WideBitHasNoneLookup,
+)
+from bitfield.types import BitHandler, Bit, BitFieldSchema, get_set_labels, register_schema
 
 # Count binary capacity. Truncate "0b" prefix from binary form.
 # Twice faster than bin(i)[2:] or math.floor(math.log(i))
 MAX_FLAG_COUNT = int(len(bin(BigIntegerField.MAX_BIGINT)) - 2)
 
 
+def parse_flags(flags, default=None, max_count=None):
+    """
+    Normalize the ``flags`` and ``default`` arguments of a bit field.
+
+    Returns ``(arg_flags, flags, labels, default)`` where ``arg_flags`` is
+    what ``deconstruct`` should record.
+    """
+    if isinstance(flags, dict):
+        # Get only integer keys in correct range
+        valid_keys = (k for k in flags.keys() if isinstance(k, int) and k >= 0
+                      and (max_count is None or k < max_count))
+        if not valid_keys:
+            raise ValueError('Wrong keys or empty dictionary')
+        # Fill list with values from dict or with empty values
+        flags = [flags.get(i, '') for i in range(max(valid_keys) + 1)]
+
+    if max_count is not None and len(flags) > max_count:
+        raise ValueError('Too many flags')
+
+    arg_flags = flags
+    flags = list(flags)
+    labels = []
+    for num, flag in enumerate(flags):
+        if isinstance(flag, (tuple, list)):
+            flags[num] = flag[0]
+            labels.append(flag[1])
+        else:
+            labels.append(flag)
+
+    if isinstance(default, (list, tuple, set, frozenset)):
+        new_value = 0
+        for flag in default:
+            new_value |= Bit(flags.index(flag))
+        default = new_value
+
+    return arg_flags, flags, labels, default
+
+
 class BitFieldFlags(object):
-    def __init__(self, flags):
-        if len(flags) > MAX_FLAG_COUNT:
+    def __init__(self, flags, schema=None):
+        if schema is None and len(flags) > MAX_FLAG_COUNT:
             raise ValueError('Too many flags')
         self._flags = flags
+        self._schema = schema if schema is not None else BitFieldSchema(flags)
 
     def __repr__(self):
         return repr(self._flags)
@@ -24,7 +68,7 @@ class BitFieldFlags(object):
             yield flag
 
     def __getattr__(self, key):
-        if key == '_flags':
+        if key in ('_flags', '_schema'):
             # Since __getattr__ is for fallback, reaching here from Python
             # means that there's no '_flags' attribute in this object,
             # which may be caused by intermediate state while copying etc.
@@ -32,28 +76,30 @@ class BitFieldFlags(object):
                 "'%s' object has no attribute '%s'" % (self.__class__.__name__, key)
             )
         try:
-            flags = self._flags
+            numbers = self._schema.numbers
         except AttributeError:
             raise AttributeError(
                 "'%s' object has no attribute '%s'" % (self.__class__.__name__, key)
             )
         try:
-            flag = flags.index(key)
-        except ValueError:
+            flag = numbers[key]
+        except KeyError:
             raise AttributeError("flag {} is not registered".format(key))
         return Bit(flag)
 
     def iteritems(self):
+        numbers = self._schema.numbers
         for flag in self._flags:
-            yield flag, Bit(self._flags.index(flag))
+            yield flag, Bit(numbers[flag])
 
     def iterkeys(self):
         for flag in self._flags:
             yield flag
 
     def itervalues(self):
+        numbers = self._schema.numbers
         for flag in self._flags:
-            yield Bit(self._flags.index(flag))
+            yield Bit(numbers[flag])
 
     def items(self):
         return list(self.iteritems())
@@ -65,6 +111,15 @@ class BitFieldFlags(object):
         return list(self.itervalues())
 
 
+def mark_replaced(handler):
+    """
+    Record every flag of ``handler`` as changed, so that saving it writes
+    its whole value.
+    """
+    handler._set_mask, handler._clear_mask = handler._value, ~handler._value
+    return handler
+
+
 class BitFieldCreator(object):
     """
     A placeholder class that provides a way to set the attribute on the model.
@@ -75,17 +130,50 @@ class BitFieldCreator(object):
     """
     def __init__(self, field):
         self.field = field
+        self._class_flags = None
+        if not field.model._meta.abstract:
+            register_schema(field.schema, field.model._meta.label, field.name)
 
     def __set__(self, obj, value):
-        obj.__dict__[self.field.name] = self.field.to_python(value)
+        # The handler is built lazily on first access; until then the raw
+        # value is kept so that loading rows which never touch their flags
+        # stays cheap.
+        state = getattr(obj, '_state', None)
+        if state is not None and not state.adding and not hasattr(value, 'resolve_expression'):
+            if (isinstance(value, BitHandler) and value._row == (self.field, obj.pk)
+                    and not (value._set_mask or value._clear_mask)):
+                # Read unchanged from this very row, e.g. by
+                # ``refresh_from_db()``: it is the stored value now.
+                value = value._value
+            else:
+                # Replacing the value of a saved row: record every flag as
+                # changed so that the next save writes the whole value.
+                value = mark_replaced(self.field.to_python(self.field.to_int(value)))
+        elif isinstance(value, BitHandler):
+            value = self.field.to_python(value)
+        obj.__dict__[self.field.name] = value
 
     def __get__(self, obj, type=None):
         if obj is None:
-            return BitFieldFlags(self.field.flags)
+            if self._class_flags is None:
+                self._class_flags = BitFieldFlags(self.field.flags, self.field.schema)
+            return self._class_flags
         retval = obj.__dict__[self.field.name]
-        if self.field.__class__ is BitField:
+        if not isinstance(retval, BitHandler):
+            if hasattr(retval, 'resolve_expression'):
+                return retval
+            raw, retval = retval, self.field.to_python(retval)
+            if not obj._state.adding:
+                if retval._value != raw:
+                    # Repaired bad data, see ``BitField.to_int``: write it
+                    # back on the next save.
+                    mark_replaced(retval)
+                else:
+                    retval._row = (self.field, obj.pk)
+            obj.__dict__[self.field.name] = retval
+        elif self.field.__class__ is BitField:
             # Update flags from class in case they've changed.
-            retval._keys = self.field.flags
+            retval._schema = self.field.schema
         return retval
 
 
@@ -94,38 +182,57 @@ class BitField(BigIntegerField):
     def contribute_to_class(self, cls, name, **kwargs):
         super(BitField, self).contribute_to_class(cls, name, **kwargs)
         setattr(cls, self.name, BitFieldCreator(self))
-
-    def __init__(self, flags, default=None, *args, **kwargs):
-        if isinstance(flags, dict):
-            # Get only integer keys in correct range
-            valid_keys = (k for k in flags.keys() if isinstance(k, int) and (0 <= k < MAX_FLAG_COUNT))
-            if not valid_keys:
-                raise ValueError('Wrong keys or empty dictionary')
-            # Fill list with values from dict or with empty values
-            flags = [flags.get(i, '') for i in range(max(valid_keys) + 1)]
-
-        if len(flags) > MAX_FLAG_COUNT:
-            raise ValueError('Too many flags')
-
-        self._arg_flags = flags
-        flags = list(flags)
-        labels = []
-        for num, flag in enumerate(flags):
-            if isinstance(flag, (tuple, list)):
-                flags[num] = flag[0]
-                labels.append(flag[1])
-            else:
-                labels.append(flag)
-
-        if isinstance(default, (list, tuple, set, frozenset)):
-            new_value = 0
-            for flag in default:
-                new_value |= Bit(flags.index(flag))
-            default = new_value
-
+        # post_save is sent with the class that was saved, which may be a proxy
+        # or a multi-table child: connect to every sender and filter.
+        signals.post_save.connect(
+            self.reset_changes, weak=False,
+            dispatch_uid='bitfield.reset_changes.%s.%s' % (id(cls), self.name))
+        if self.materialized:
+            from bitfield.generated import MaterializedFlagField
+            for flag in self.materialized:
+                column = MaterializedFlagField(self.name, self.schema.numbers[flag])
+                column.contribute_to_class(cls, self.get_materialized_name(flag))
+
+    # Sidecar model indexing the ``indexed`` flags, see
+    # ``bitfield.sidecar.create_sidecar_model``.
+    sidecar = None
+
+    def __init__(self, flags, default=None, *args, materialized=(), indexed=(), **kwargs):
+        self._arg_flags, flags, labels, default = parse_flags(flags, default, MAX_FLAG_COUNT)
         BigIntegerField.__init__(self, default=default, *args, **kwargs)
         self.flags = flags
         self.labels = labels
+        self.schema = BitFieldSchema(flags, labels)
+        for flag in tuple(materialized) + tuple(indexed):
+            if flag not in self.schema.numbers:
+                raise ValueError('%s is not a valid flag' % flag)
+        if materialized:
+            try:
+                from bitfield.generated import MaterializedFlagField  # NOQA
+            except ImportError:
+                raise ImproperlyConfigured('Materialized flags require Django 5.0 or later')
+        self.materialized = tuple(materialized)
+        self.indexed = tuple(indexed)
+
+    def get_materialized_name(self, flag):
+        return '%s_%s' % (self.name, flag)
+
+    def get_materialized_fields(self):
+        """
+        Return a dict mapping the bit number of every materialized flag to
+        its generated column field.
+        """
+        opts = self.model._meta
+        return dict(
+            (self.schema.numbers[flag], opts.get_field(self.get_materialized_name(flag)))
+            for flag in self.materialized
+        )
+
+    def get_indexed_numbers(self):
+        """
+        Return the set of bit numbers of the flags kept in the sidecar table.
+        """
+        return set(self.schema.numbers[flag] for flag in self.indexed)
 
     def formfield(self, form_class=BitFormField, **kwargs):
         choices = [(k, self.labels[self.flags.index(k)]) for k in self.flags]
@@ -138,80 +245,250 @@ class BitField(BigIntegerField):
             value = value.mask
         return int(value)
 
-    # def get_db_prep_save(self, value, connection):
-    #     if isinstance(value, Bit):
-    #         return BitQuerySaveWrapper(self.model._meta.db_table, self.name, value)
-    #     return super(BitField, self).get_db_prep_save(value, connection=connection)
-
-    def to_python(self, value):
-        if isinstance(value, Bit):
+    def pre_save(self, model_instance, add):
+        try:
+            value = model_instance.__dict__[self.attname]
+        except KeyError:
+            return super(BitField, self).pre_save(model_instance, add)
+        if hasattr(value, 'resolve_expression'):
+            return value
+        if not (add or model_instance._state.adding):
+            # Only write the flags changed since the row was loaded, so
+            # that concurrent saves changing other flags are not lost.  A
+            # raw value is one that was loaded and never touched.
+            if not isinstance(value, BitHandler):
+                value = self.to_int(value)
+                if value == model_instance.__dict__[self.attname]:
+                    return BitUpdateExpression(self.name)
+                # Repaired bad data, see ``to_int``.
+                value = mark_replaced(BitHandler(value, self.schema))
+            set_mask, clear_mask = value.get_changes()
+            return BitUpdateExpression(self.name, set_mask, clear_mask)
+        if isinstance(value, BitHandler):
+            return value
+        # Save the raw value without materializing a handler.
+        return self.to_int(value)
+
+    def get_raw_value(self, instance):
+        """
+        Return the integer value of this field on ``instance`` without
+        building a ``BitHandler``, for comparing or exporting the flags of
+        many rows.  Expressions are returned as is.
+        """
+        try:
+            value = instance.__dict__[self.attname]
+        except KeyError:
+            value = getattr(instance, self.attname)
+        if hasattr(value, 'resolve_expression'):
+            return value
+        return self.to_int(value)
+
+    def get_set_labels(self, value):
+        """
+        Return the labels of the flags set in ``value``, an integer or a
+        ``BitHandler``, memoized per ``(field, value)``.
+        """
+        return get_set_labels(self.schema, self.to_int(value))
+
+    def render_labels(self, value, separator=', '):
+        return separator.join(self.get_set_labels(value))
+
+    def reset_changes(self, instance, sender=None, update_fields=None, **kwargs):
+        if sender is not None and not issubclass(sender._meta.concrete_model, self.model):
+            return
+        if update_fields is not None and self.name not in update_fields:
+            return
+        value = instance.__dict__.get(self.attname)
+        if isinstance(value, BitHandler):
+            value.reset_changes()
+
+    def to_int(self, value):
+        """
+        Return the integer value a ``BitHandler`` built from ``value`` holds.
+        """
+        if isinstance(value, (BitHandler, Bit)):
             value = value.mask
-        if not isinstance(value, BitHandler):
+        value = int(value) if value else 0
+        if value < 0:
             # Regression for #1425: fix bad data that was created resulting
             # in negative values for flags.  Compute the value that would
             # have been visible ot the application to preserve compatibility.
-            if isinstance(value, int) and value < 0:
-                new_value = 0
-                for bit_number, _ in enumerate(self.flags):
-                    new_value |= (value & (2 ** bit_number))
-                value = new_value
+            value &= self.schema.mask
+        return value
 
-            value = BitHandler(value, self.flags, self.labels)
+    def to_python(self, value):
+        if not isinstance(value, BitHandler):
+            value = BitHandler(self.to_int(value), self.schema)
         else:
             # Ensure flags are consistent for unpickling
-            value._keys = self.flags
+            value._schema = self.schema
         return value
 
+    def check(self, **kwargs):
+        errors = super(BitField, self).check(**kwargs)
+        errors.extend(self._check_sidecar_manager())
+        return errors
+
+    def _check_sidecar_manager(self):
+        from bitfield.managers import BitQuerySet
+
+        if self.sidecar is None:
+            return []
+        if isinstance(self.model._default_manager.get_queryset(), BitQuerySet):
+            return []
+        return [checks.Error(
+            "Fields with a sidecar table require the model's default manager to be "
+            "a BitManager, other querysets' update() leave the sidecar out of sync.",
+            hint="Add 'objects = BitManager()' to %s." % self.model._meta.label,
+            obj=self,
+            id='bitfield.E001',
+        )]
+
     def deconstruct(self):
         name, path, args, kwargs = super(BitField, self).deconstruct()
         args.insert(0, self._arg_flags)
+        if self.materialized:
+            kwargs['materialized'] = self.materialized
+        if self.indexed:
+            kwargs['indexed'] = self.indexed
         return name, path, args, kwargs
 
 
 BitField.register_lookup(BitQueryLookupWrapper)
+BitField.register_lookup(BitHasAllLookup)
+BitField.register_lookup(BitHasAnyLookup)
+BitField.register_lookup(BitHasNoneLookup)
+BitField.register_lookup(BitCount)
 
 
-class CompositeBitFieldWrapper(object):
-    def __init__(self, fields):
-        self.fields = fields
+class WideBitField(BinaryField):
+    """
+    A BitField without the 64 flag limit, stored as a little-endian binary
+    string (``bytea`` on PostgreSQL, ``BLOB`` on SQLite/MySQL) where byte
+    ``n // 8`` holds flag ``n``.
+
+    Values are exposed through the same ``BitHandler`` API and support the
+    ``flags=Bit(n)``, ``has_all``, ``has_any`` and ``has_none`` lookups, which
+    only read the bytes holding the flags being tested.  Bulk SQL arithmetic
+    (``F()`` expressions, ``update_bits``) and ``BitFlagIndex`` are not
+    supported.
+    """
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(WideBitField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.name, BitFieldCreator(self))
 
-    def __getattr__(self, attr):
-        if attr == 'fields':
-            return super(CompositeBitFieldWrapper, self).__getattr__(attr)
+    def __init__(self, flags, default=None, *args, **kwargs):
+        self._arg_flags, flags, labels, default = parse_flags(flags, default)
+        kwargs.setdefault('editable', True)
+        BinaryField.__init__(self, default=default, *args, **kwargs)
+        self.flags = flags
+        self.labels = labels
+        self.schema = BitFieldSchema(flags, labels)
+        self.num_bytes = max((len(flags) + 7) // 8, 1)
 
-        for field in self.fields:
-            if hasattr(field, attr):
-                return getattr(field, attr)
-        raise AttributeError('%s is not a valid flag' % attr)
+    def formfield(self, form_class=BitFormField, **kwargs):
+        choices = [(k, self.labels[self.flags.index(k)]) for k in self.flags]
+        return Field.formfield(self, form_class, choices=choices, **kwargs)
 
-    def __hasattr__(self, attr):
-        if attr == 'fields':
-            return super(CompositeBitFieldWrapper, self).__hasattr__(attr)
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.to_int(value)
 
-        for field in self.fields:
-            if hasattr(field, attr):
-                return True
-        return False
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        value = self.to_int(value) & ((1 << (8 * self.num_bytes)) - 1)
+        return value.to_bytes(self.num_bytes, 'little')
 
-    def __setattr__(self, attr, value):
-        if attr == 'fields':
-            super(CompositeBitFieldWrapper, self).__setattr__(attr, value)
-            return
+    def pre_save(self, model_instance, add):
+        try:
+            value = model_instance.__dict__[self.attname]
+        except KeyError:
+            return super(WideBitField, self).pre_save(model_instance, add)
+        if isinstance(value, BitHandler):
+            return value
+        return self.to_int(value)
+
+    def to_int(self, value):
+        """
+        Return the integer value a ``BitHandler`` built from ``value`` holds.
+        """
+        if isinstance(value, (BitHandler, Bit)):
+            return value.mask
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return int.from_bytes(bytes(value), 'little')
+        value = int(value) if value else 0
+        if value < 0:
+            value &= self.schema.mask
+        return value
 
-        for field in self.fields:
-            if hasattr(field, attr):
-                setattr(field, attr, value)
-                return
-        raise AttributeError('%s is not a valid flag' % attr)
+    def to_python(self, value):
+        if not isinstance(value, BitHandler):
+            value = BitHandler(self.to_int(value), self.schema)
+        else:
+            value._schema = self.schema
+        return value
+
+    def value_to_string(self, obj):
+        return str(self.to_int(self.value_from_object(obj)))
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(WideBitField, self).deconstruct()
+        args.insert(0, self._arg_flags)
+        if kwargs.get('editable'):
+            del kwargs['editable']
+        else:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+
+
+WideBitField.register_lookup(WideBitQueryLookupWrapper)
+WideBitField.register_lookup(WideBitHasAllLookup)
+WideBitField.register_lookup(WideBitHasAnyLookup)
+WideBitField.register_lookup(WideBitHasNoneLookup)
+
+
+class CompositeBitFieldWrapper(object):
+    """
+    Instance level view of a ``CompositeBitField``, routing each flag to the
+    BitField holding it.
+    """
+    def __init__(self, instance, composite):
+        object.__setattr__(self, '_instance', instance)
+        object.__setattr__(self, '_composite', composite)
+
+    def _get_handler(self, attr):
+        try:
+            field_name, _ = self._composite.routes[attr]
+        except KeyError:
+            raise AttributeError('%s is not a valid flag' % attr)
+        return getattr(self._instance, field_name)
+
+    @property
+    def fields(self):
+        return [getattr(self._instance, f) for f in self._composite.fields]
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            return object.__getattribute__(self, attr)
+        return getattr(self._get_handler(attr), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._get_handler(attr), attr, value)
 
 
 class CompositeBitField(object):
     is_relation = False
     many_to_many = False
     concrete = False
+    # Virtual field: skipped by Model.__init__.
+    column = None
+    generated = False
 
     def __init__(self, fields):
         self.fields = fields
+        self.routes = {}
 
     def contribute_to_class(self, cls, name):
         self.name = name
@@ -229,10 +506,53 @@ class CompositeBitField(object):
         all_flags = sum([model_fields[f].flags for f in self.fields], [])
         if len(all_flags) != len(set(all_flags)):
             raise ValueError('BitField flags must be unique.')
+        # Map every flag to the field holding it and its mask there.
+        routes = {}
+        for field_name in self.fields:
+            schema = model_fields[field_name].schema
+            for flag, number in schema.numbers.items():
+                routes[flag] = (field_name, schema.masks[number])
+        self.routes = routes
+
+    def get_q(self, lookup, flags):
+        """
+        Return a ``Q`` applying ``lookup`` (``'has_all'``, ``'has_any'`` or
+        ``'has_none'``) to ``flags``, with the flags of each underlying
+        BitField merged into a single mask test.
+        """
+        if lookup not in ('has_all', 'has_any', 'has_none'):
+            raise ValueError('Unsupported CompositeBitField lookup: %s' % lookup)
+        if isinstance(flags, str):
+            flags = (flags,)
+        masks = {}
+        for flag in flags:
+            try:
+                field_name, mask = self.routes[flag]
+            except KeyError:
+                raise ValueError('%s is not a valid flag' % flag)
+            masks[field_name] = masks.get(field_name, 0) | mask
+
+        if not masks:
+            # No flags: nothing can match any of them, everything matches
+            # all or none of them.
+            return Q(pk__in=[]) if lookup == 'has_any' else Q()
+        q = None
+        for field_name in self.fields:
+            if field_name not in masks:
+                continue
+            part = Q(**{'%s__%s' % (field_name, lookup): masks[field_name]})
+            if q is None:
+                q = part
+            elif lookup == 'has_any':
+                q |= part
+            else:
+                q &= part
+        return q
 
     def __get__(self, instance, instance_type=None):
-        fields = [getattr(instance, f) for f in self.fields]
-        return CompositeBitFieldWrapper(fields)
+        if instance is None:
+            return self
+        return CompositeBitFieldWrapper(instance, self)
 
     def __set__(self, *args, **kwargs):
         raise NotImplementedError('CompositeBitField cannot be set.')
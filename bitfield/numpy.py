@@ -0,0 +1,75 @@
+"""
+Vectorized export of BitField columns using NumPy.
+
+Requires ``numpy`` (``pip install django-bitfield[numpy]``)::
+
+    from bitfield.numpy import to_array, to_flag_matrix
+
+    values = to_array(MyModel.objects.all(), 'flags')
+    matrix, flags = to_flag_matrix(MyModel.objects.all(), 'flags')
+    counts = dict(zip(flags, matrix.sum(axis=0)))
+"""
+from __future__ import absolute_import
+
+from itertools import islice
+
+import numpy as np
+
+from bitfield.models import BitField
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _get_field(queryset, field_name):
+    field = queryset.model._meta.get_field(field_name)
+    if not isinstance(field, BitField):
+        raise TypeError('%s is not a BitField' % field_name)
+    return field
+
+
+def to_array(queryset, field_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return the values of ``field_name`` for every row of ``queryset`` as a
+    one dimensional ``uint64`` array.
+
+    Rows are streamed from the database ``chunk_size`` at a time.  NULLs are
+    read as ``0`` and negative values are repaired the same way
+    ``BitField.to_python`` repairs them.
+    """
+    field = _get_field(queryset, field_name)
+    rows = queryset.values_list(field_name, flat=True).iterator(chunk_size=chunk_size)
+    rows = (value or 0 for value in rows)
+
+    chunks = []
+    while True:
+        chunk = np.fromiter(islice(rows, chunk_size), dtype=np.int64)
+        if not len(chunk):
+            break
+        chunks.append(chunk)
+    if not chunks:
+        return np.zeros(0, dtype=np.uint64)
+
+    values = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+    values &= field.schema.mask
+    return values.view(np.uint64)
+
+
+def unpack(values, flags):
+    """
+    Unpack an array of packed flag values into an ``(n_rows, n_flags)``
+    boolean matrix whose columns follow the order of ``flags``.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = np.arange(len(flags), dtype=np.uint64)
+    return ((values[:, np.newaxis] >> shifts) & np.uint64(1)).astype(bool)
+
+
+def to_flag_matrix(queryset, field_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return ``(matrix, flags)`` where ``matrix`` is the boolean flag matrix of
+    ``field_name`` for every row of ``queryset`` and ``flags`` is the tuple of
+    flag names labelling its columns.
+    """
+    field = _get_field(queryset, field_name)
+    flags = field.schema.keys
+    return unpack(to_array(queryset, field_name, chunk_size=chunk_size), flags), flags
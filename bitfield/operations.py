@@ -0,0 +1,193 @@
+"""
+Migration operations rewriting stored flag values in SQL.
+
+Removing or inserting a flag in the middle of a ``flags`` tuple changes the
+bit numbers of the flags after it.  ``RemapBits`` moves every stored bit to
+the new number of its flag and clears the bits of removed flags::
+
+    operations = [
+        migrations.AlterField('article', 'flags', BitField(flags=('b', 'c'))),
+        RemapBits('article', 'flags', ['a', 'b', 'c'], ['b', 'c']),
+    ]
+
+Rows are updated in batches of consecutive primary keys.  Each batch is a
+single ``UPDATE`` made of masks and shifts.  ``bitfield.autodetector`` can
+have ``makemigrations`` add these operations when a BitField's flags move.
+"""
+from __future__ import absolute_import
+
+from django.db import router
+from django.db.migrations.operations.base import Operation
+from django.db.models import F, Value
+
+from bitfield.models import parse_flags
+
+# Number of rows rewritten per UPDATE.
+REMAP_BATCH_SIZE = 1000
+
+
+def get_flag_names(flags):
+    """
+    Return the flag names of a ``flags`` argument, ``''`` marking unused
+    bits.
+    """
+    return parse_flags(flags)[1]
+
+
+def get_bit_permutation(old_flags, new_flags, renames=None):
+    """
+    Return a dict mapping the old bit number of every flag kept in
+    ``new_flags`` to its new bit number.
+
+    Flags are matched by name, ``renames`` maps old names to new ones.  Bits
+    missing from the result are cleared.
+    """
+    renames = renames or {}
+    new_numbers = dict(
+        (flag, number) for number, flag in enumerate(get_flag_names(new_flags)) if flag)
+    permutation = {}
+    for number, flag in enumerate(get_flag_names(old_flags)):
+        flag = renames.get(flag, flag)
+        if flag in new_numbers:
+            permutation[number] = new_numbers[flag]
+    return permutation
+
+
+def is_identity(permutation, old_flags):
+    """
+    Return whether ``permutation`` keeps every flag of ``old_flags`` in
+    place, i.e. rewriting the data is unnecessary.
+    """
+    numbers = [number for number, flag in enumerate(get_flag_names(old_flags)) if flag]
+    return all(permutation.get(number) == number for number in numbers)
+
+
+def to_signed(mask):
+    # BigIntegerField columns are signed, flag 63 is their sign bit.
+    return mask - (1 << 64) if mask >= 1 << 63 else mask
+
+
+def get_remap_expression(field_name, permutation):
+    """
+    Return an expression of ``field_name`` with its bits moved according to
+    ``permutation``.
+
+    Bits moving by the same distance are shifted together, so the
+    expression has one term per distinct distance.
+    """
+    shifts = {}
+    for old, new in permutation.items():
+        shifts[new - old] = shifts.get(new - old, 0) | 1 << old
+    expression = None
+    for shift, mask in sorted(shifts.items()):
+        if shift > 0:
+            term = F(field_name).bitand(mask).bitleftshift(shift)
+        elif shift < 0:
+            # Mask after shifting, right shifts of negative values carry
+            # the sign bit along.
+            term = F(field_name).bitrightshift(-shift).bitand(mask >> -shift)
+        else:
+            term = F(field_name).bitand(to_signed(mask))
+        expression = term if expression is None else expression.bitor(term)
+    if expression is None:
+        return Value(0)
+    return expression
+
+
+def remap_bits(model, field_name, old_flags, new_flags, renames=None, using=None,
+               batch_size=REMAP_BATCH_SIZE):
+    """
+    Rewrite ``model.field_name`` from ``old_flags`` bit numbers to
+    ``new_flags`` ones, ``batch_size`` rows per ``UPDATE``.
+
+    Batches are bounded by primary keys read from the primary key index, so
+    every ``UPDATE`` touches at most ``batch_size`` rows however sparse the
+    keys are.  Returns the number of rows updated.
+    """
+    permutation = get_bit_permutation(old_flags, new_flags, renames)
+    if is_identity(permutation, old_flags):
+        return 0
+    expression = get_remap_expression(field_name, permutation)
+    queryset = model._base_manager.using(using).order_by('pk')
+    updated = 0
+    last = None
+    while True:
+        rows = queryset if last is None else queryset.filter(pk__gt=last)
+        bound = list(rows.values_list('pk', flat=True)[batch_size - 1:batch_size])
+        if not bound:
+            return updated + rows.update(**{field_name: expression})
+        updated += rows.filter(pk__lte=bound[0]).update(**{field_name: expression})
+        last = bound[0]
+
+
+class RemapBits(Operation):
+    """
+    Move the stored bits of a BitField from the numbering of ``old_flags``
+    to that of ``new_flags``.
+
+    The field itself is altered by an ``AlterField`` operation, this only
+    rewrites the data.  Flags are matched by name; ``renames`` maps old flag
+    names to new ones.  Bits of flags missing from ``new_flags`` are
+    cleared, so reversing the operation cannot restore them.
+    """
+    reversible = True
+    reduces_to_sql = False
+
+    def __init__(self, model_name, name, old_flags, new_flags, renames=None,
+                 batch_size=REMAP_BATCH_SIZE):
+        self.model_name = model_name
+        self.name = name
+        self.old_flags = old_flags
+        self.new_flags = new_flags
+        self.renames = renames or {}
+        self.batch_size = batch_size
+
+    @property
+    def model_name_lower(self):
+        return self.model_name.lower()
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'name': self.name,
+            'old_flags': self.old_flags,
+            'new_flags': self.new_flags,
+        }
+        if self.renames:
+            kwargs['renames'] = self.renames
+        if self.batch_size != REMAP_BATCH_SIZE:
+            kwargs['batch_size'] = self.batch_size
+        return (self.__class__.__name__, [], kwargs)
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def remap(self, app_label, schema_editor, state, old_flags, new_flags, renames):
+        model = state.apps.get_model(app_label, self.model_name)
+        alias = schema_editor.connection.alias
+        if router.allow_migrate_model(alias, model):
+            remap_bits(
+                model, self.name, old_flags, new_flags, renames=renames, using=alias,
+                batch_size=self.batch_size)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.remap(
+            app_label, schema_editor, to_state, self.old_flags, self.new_flags, self.renames)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        renames = dict((new, old) for old, new in self.renames.items())
+        self.remap(
+            app_label, schema_editor, to_state, self.new_flags, self.old_flags, renames)
+
+    def references_field(self, model_name, name, app_label):
+        return model_name.lower() == self.model_name_lower and name.lower() == self.name.lower()
+
+    def references_model(self, name, app_label):
+        return name.lower() == self.model_name_lower
+
+    def describe(self):
+        return 'Remap the bits of %s.%s' % (self.model_name, self.name)
+
+    @property
+    def migration_name_fragment(self):
+        return 'remap_%s_%s' % (self.model_name_lower, self.name.lower())
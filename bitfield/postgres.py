@@ -0,0 +1,182 @@
+"""
+Native PostgreSQL ``bit(n)`` / ``bit varying(n)`` storage for flags.
+"""
+from __future__ import absolute_import
+
+from django.db.models import Field
+from django.db.models.lookups import Exact
+
+from bitfield.forms import BitFormField
+from bitfield.models import BitFieldCreator, parse_flags
+from bitfield.query import BitMaskLookup
+from bitfield.types import Bit, BitFieldSchema, BitHandler
+
+
+def to_bit_string(value, length):
+    """
+    Return ``value`` as a string of ``length`` ``0``/``1`` characters, flag 0
+    being the leftmost bit as in PostgreSQL's ``get_bit``/``substring``.
+    """
+    return ''.join('1' if value >> n & 1 else '0' for n in range(length))
+
+
+def from_bit_string(value):
+    return int(value[::-1], 2) if value else 0
+
+
+def get_bit_string_mask_sql(lhs_sql, mask, length, mode):
+    """
+    Compile a test of ``mask`` against the bit string ``lhs_sql`` of
+    ``length`` bits with native bit string operators.  ``mode`` is one of
+    ``'all'``, ``'any'`` or ``'none'``.
+    """
+    mask_sql = "B'%s'" % to_bit_string(mask, length)
+    zero_sql = "B'%s'" % ('0' * length)
+    masked_sql = '(%s & %s)' % (lhs_sql, mask_sql)
+    if mode == 'all':
+        return '%s = %s' % (masked_sql, mask_sql)
+    if mode == 'any':
+        return '%s <> %s' % (masked_sql, zero_sql)
+    return '%s = %s' % (masked_sql, zero_sql)
+
+
+class BitStringLookupMixin(object):
+    def process_bit_string_lhs(self, compiler, connection):
+        lhs_sql, params = self.process_lhs(compiler, connection)
+        field = self.lhs.output_field
+        if field.varying:
+            # Bitwise operators need operands of equal length.
+            lhs_sql = 'CAST(%s AS bit(%d))' % (lhs_sql, field.length)
+        return lhs_sql, params, field.length
+
+
+class BitStringQueryLookupWrapper(BitStringLookupMixin, Exact):
+    def get_prep_lookup(self):
+        if isinstance(self.rhs, (BitHandler, Bit)):
+            return self.rhs
+        return super(BitStringQueryLookupWrapper, self).get_prep_lookup()
+
+    def as_sql(self, compiler, connection):
+        if not isinstance(self.rhs, (BitHandler, Bit)):
+            return super(BitStringQueryLookupWrapper, self).as_sql(compiler, connection)
+        lhs_sql, params, length = self.process_bit_string_lhs(compiler, connection)
+        if isinstance(self.rhs, Bit):
+            mode = 'all' if self.rhs.is_set else 'none'
+            mask = 1 << self.rhs.number
+        else:
+            mode, mask = 'all', self.rhs._value
+        return get_bit_string_mask_sql(lhs_sql, mask, length, mode), list(params)
+
+
+class BitStringMaskLookup(BitStringLookupMixin, BitMaskLookup):
+    def as_sql(self, compiler, connection):
+        if not isinstance(self.rhs, int):
+            raise TypeError('%s lookups on a BitStringField need flag values' % self.lookup_name)
+        lhs_sql, params, length = self.process_bit_string_lhs(compiler, connection)
+        return get_bit_string_mask_sql(lhs_sql, self.rhs, length, self.mode), list(params)
+
+
+class BitStringHasAllLookup(BitStringMaskLookup):
+    lookup_name = 'has_all'
+    mode = 'all'
+
+
+class BitStringHasAnyLookup(BitStringMaskLookup):
+    lookup_name = 'has_any'
+    mode = 'any'
+
+
+class BitStringHasNoneLookup(BitStringMaskLookup):
+    lookup_name = 'has_none'
+    mode = 'none'
+
+
+class BitStringField(Field):
+    """
+    A BitField stored in a native PostgreSQL ``bit(n)`` column, or
+    ``bit varying(n)`` with ``varying=True``, ``n`` being the number of flags.
+
+    Flag ``i`` is bit ``i`` counting from the left, so appending flags only
+    widens the column.  Values use the ``BitHandler`` API like ``BitField``
+    and the ``flags=Bit(n)``, ``has_all``, ``has_any`` and ``has_none``
+    lookups compile to native bit string operators.  There is no 64 flag
+    limit.
+    """
+    description = 'Bit string'
+
+    def __init__(self, flags, default=None, varying=False, *args, **kwargs):
+        self._arg_flags, flags, labels, default = parse_flags(flags, default)
+        if not flags:
+            raise ValueError('BitStringField needs at least one flag')
+        Field.__init__(self, default=default, *args, **kwargs)
+        self.flags = flags
+        self.labels = labels
+        self.schema = BitFieldSchema(flags, labels)
+        self.varying = varying
+        self.length = len(flags)
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(BitStringField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.name, BitFieldCreator(self))
+
+    def db_type(self, connection):
+        return '%s(%d)' % ('bit varying' if self.varying else 'bit', self.length)
+
+    def get_placeholder(self, value, compiler, connection):
+        # Parameters are sent as text; cast them to the column type.
+        return 'CAST(%%s AS %s)' % self.db_type(connection)
+
+    def formfield(self, form_class=BitFormField, **kwargs):
+        choices = [(k, self.labels[self.flags.index(k)]) for k in self.flags]
+        return Field.formfield(self, form_class, choices=choices, **kwargs)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_bit_string(value)
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_bit_string(self.to_int(value), self.length)
+
+    def pre_save(self, model_instance, add):
+        try:
+            value = model_instance.__dict__[self.attname]
+        except KeyError:
+            return super(BitStringField, self).pre_save(model_instance, add)
+        if isinstance(value, BitHandler):
+            return value
+        return self.to_int(value)
+
+    def to_int(self, value):
+        """
+        Return the integer value a ``BitHandler`` built from ``value`` holds.
+        """
+        if isinstance(value, (BitHandler, Bit)):
+            value = value.mask
+        value = int(value) if value else 0
+        return value & self.schema.mask
+
+    def to_python(self, value):
+        if not isinstance(value, BitHandler):
+            value = BitHandler(self.to_int(value), self.schema)
+        else:
+            value._schema = self.schema
+        return value
+
+    def value_to_string(self, obj):
+        return str(self.to_int(self.value_from_object(obj)))
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(BitStringField, self).deconstruct()
+        args.insert(0, self._arg_flags)
+        if self.varying:
+            kwargs['varying'] = True
+        return name, path, args, kwargs
+
+
+BitStringField.register_lookup(BitStringQueryLookupWrapper)
+BitStringField.register_lookup(BitStringHasAllLookup)
+BitStringField.register_lookup(BitStringHasAnyLookup)
+BitStringField.register_lookup(BitStringHasNoneLookup)
@@ -1,10 +1,173 @@
 from __future__ import absolute_import
 
 from bitfield.types import Bit, BitHandler
-from django.db.models.lookups import Exact
+from django.db.models import BigIntegerField, F, IntegerField
+from django.db.models.expressions import Col, Expression
+from django.db.models.lookups import Exact, Lookup, Transform
+
+# SQL selecting a single flag.  Expression indexes (``BitFlagIndex``) are
+# built on exactly this expression, and lookups test it with ``> 0`` or
+# ``= 0`` so that both PostgreSQL and SQLite can serve them from the index.
+# The mask is inlined as a literal since planners do not match parameters
+# against index expressions.
+FLAG_MASK_SQL = '(%s & %d)'
+
+
+def get_flag_sql(lhs_sql, mask, is_set=True):
+    return '%s %s 0' % (FLAG_MASK_SQL % (lhs_sql, mask), '>' if is_set else '=')
+
+
+class BitFlagExpression(Expression):
+    """
+    ``(<expression> & mask)``, the expression ``flags=Bit(n)`` lookups test.
+    """
+    output_field = BigIntegerField()
+
+    def __init__(self, expression, mask):
+        super(BitFlagExpression, self).__init__()
+        self.expression = F(expression) if isinstance(expression, str) else expression
+        self.mask = int(mask)
+
+    def __repr__(self):
+        return '%s(%r, %d)' % (self.__class__.__name__, self.expression, self.mask)
+
+    def get_source_expressions(self):
+        return [self.expression]
+
+    def set_source_expressions(self, exprs):
+        self.expression, = exprs
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.expression)
+        return FLAG_MASK_SQL % (sql, self.mask), params
+
+
+def get_mask_numbers(mask):
+    return [n for n in range(mask.bit_length()) if mask >> n & 1]
+
+
+def get_materialized_sql(lookup, compiler, connection, mask, mode):
+    """
+    Compile a test of the flags of ``mask`` (``mode`` being ``'all'``,
+    ``'any'`` or ``'none'``) against the generated columns of
+    ``BitField(materialized=...)``, or return ``None`` when some of these
+    flags are not materialized.
+    """
+    lhs = lookup.lhs
+    if not isinstance(lhs, Col) or mask <= 0 or not getattr(lhs.target, 'materialized', None):
+        return None
+    columns = lhs.target.get_materialized_fields()
+    numbers = get_mask_numbers(mask)
+    if not all(n in columns for n in numbers):
+        return None
+    parts, params = [], []
+    for n in numbers:
+        sql, col_params = compiler.compile(columns[n].get_col(lhs.alias))
+        parts.append('%s = %%s' % sql)
+        params.extend(col_params)
+        params.append(mode != 'none')
+    sql = (' OR ' if mode == 'any' else ' AND ').join(parts)
+    return ('(%s)' % sql if len(parts) > 1 else sql), params
+
+
+def get_sidecar_sql(lookup, compiler, connection, mask, mode):
+    """
+    Compile a test of the flags of ``mask`` as a semi-join against the
+    sidecar table of ``BitField(indexed=...)``, or return ``None`` when some
+    of these flags are not indexed.
+    """
+    lhs = lookup.lhs
+    if not isinstance(lhs, Col) or mask <= 0 or getattr(lhs.target, 'sidecar', None) is None:
+        return None
+    if lhs.alias is None:
+        # Index and constraint conditions are compiled without table
+        # aliases, and databases reject subqueries there.
+        return None
+    field = lhs.target
+    numbers = get_mask_numbers(mask)
+    if not set(numbers) <= field.get_indexed_numbers():
+        return None
+    qn = connection.ops.quote_name
+    opts = field.sidecar._meta
+    pk_sql, params = compiler.compile(field.model._meta.pk.get_col(lhs.alias))
+    subquery = 'SELECT %s FROM %s WHERE %s' % (
+        qn(opts.get_field('row').column), qn(opts.db_table), qn(opts.get_field('number').column))
+    if mode == 'all':
+        parts = ['%s IN (%s = %d)' % (pk_sql, subquery, n) for n in numbers]
+        params = list(params) * len(parts)
+        sql = ' AND '.join(parts)
+        return ('(%s)' % sql if len(parts) > 1 else sql), params
+    return '%s %s (%s IN (%s))' % (
+        pk_sql, 'NOT IN' if mode == 'none' else 'IN', subquery,
+        ', '.join('%d' % n for n in numbers)), list(params)
+
+
+def get_planned_sql(lookup, compiler, connection, mask, mode):
+    """
+    Return the SQL of a flag test served by generated columns or a sidecar
+    table, or ``None`` to fall back to masking the column.
+    """
+    sql = get_materialized_sql(lookup, compiler, connection, mask, mode)
+    if sql is None:
+        sql = get_sidecar_sql(lookup, compiler, connection, mask, mode)
+    return sql
+
+
+class BitCount(Transform):
+    """
+    The number of flags set, usable as an expression (``BitCount('flags')``)
+    or as the ``flags__bitcount`` transform.
+
+    Compiles to ``BIT_COUNT`` on MySQL and ``bit_count`` on PostgreSQL 14+.
+    Elsewhere the bits are summed with SWAR arithmetic, which only uses
+    shifts, masks and additions so that it does not overflow BIGINT.
+    """
+    lookup_name = 'bitcount'
+    output_field = IntegerField()
+
+    def get_flag_count(self):
+        schema = getattr(self.lhs.output_field, 'schema', None)
+        return len(schema) if schema is not None else 63
+
+    def get_masked_sql(self, compiler, connection):
+        # Repairs negative values like ``BitField.to_int`` does.
+        lhs_sql, params = compiler.compile(self.lhs)
+        return FLAG_MASK_SQL % (lhs_sql, (1 << self.get_flag_count()) - 1), params
+
+    def as_sql(self, compiler, connection):
+        x, params = self.get_masked_sql(compiler, connection)
+        # Bits set in each nibble, then in each byte.
+        nibbles = '(%s - ((%s >> 1) & %d) - ((%s >> 2) & %d) - ((%s >> 3) & %d))' % (
+            x, x, 0x7777777777777777, x, 0x3333333333333333, x, 0x1111111111111111)
+        octets = '((%s + (%s >> 4)) & %d)' % (nibbles, nibbles, 0x0F0F0F0F0F0F0F0F)
+        byte_count = (self.get_flag_count() + 7) // 8
+        sql = ' + '.join('((%s >> %d) & 255)' % (octets, 8 * n) for n in range(byte_count))
+        return '(%s)' % sql, list(params) * (8 * byte_count)
+
+    def as_mysql(self, compiler, connection):
+        x, params = self.get_masked_sql(compiler, connection)
+        return 'BIT_COUNT(%s)' % x, params
+
+    def as_postgresql(self, compiler, connection):
+        if connection.pg_version < 140000:
+            return self.as_sql(compiler, connection)
+        x, params = self.get_masked_sql(compiler, connection)
+        return 'bit_count(CAST(%s AS bit(64)))' % x, params
 
 
 class BitQueryLookupWrapper(Exact):  # NOQA
+    def as_sql(self, compiler, connection):
+        if not isinstance(self.rhs, Bit):
+            return super(BitQueryLookupWrapper, self).as_sql(compiler, connection)
+        bit = self.rhs
+        planned = get_planned_sql(
+            self, compiler, connection, 1 << bit.number, 'all' if bit.is_set else 'none')
+        if planned is not None:
+            return planned
+        lhs_sql, params = super(BitQueryLookupWrapper, self).process_lhs(
+            compiler, connection)
+        return get_flag_sql(lhs_sql, 1 << bit.number, bit.is_set), list(params)
+
     def process_lhs(self, compiler, connection, lhs=None):
         lhs_sql, lhs_params = super(BitQueryLookupWrapper, self).process_lhs(
             compiler, connection, lhs)
@@ -29,24 +192,234 @@ class BitQueryLookupWrapper(Exact):  # NOQA
         return super(BitQueryLookupWrapper, self).get_prep_lookup()
 
 
-class BitQuerySaveWrapper(BitQueryLookupWrapper):
-    def as_sql(self, qn, connection):
-        """
-        Create the proper SQL fragment. This inserts something like
-        "(T0.flags & value) != 0".
+def get_flags_mask(flags, schema=None):
+    """
+    Combine ``flags`` into a single integer mask.
+
+    ``flags`` may be a single value or an iterable of flag names, ``Bit``s,
+    ``BitHandler``s or integer masks.  Flag names are resolved through
+    ``schema``.
+    """
+    if isinstance(flags, (str, int, Bit, BitHandler)):
+        flags = (flags,)
+    mask = 0
+    for flag in flags:
+        if isinstance(flag, Bit):
+            mask |= 1 << flag.number
+        elif isinstance(flag, BitHandler):
+            mask |= flag._value
+        elif isinstance(flag, str):
+            try:
+                mask |= schema.masks[schema.numbers[flag]]
+            except (AttributeError, KeyError):
+                raise ValueError('%s is not a valid flag' % flag)
+        else:
+            mask |= int(flag)
+    return mask
+
+
+class BitMaskLookup(Lookup):
+    """
+    Base class for lookups testing several flags with a single mask, e.g.
+    ``flags__has_all=['FLAG_0', 'FLAG_1']``.
+    """
+    prepare_rhs = False
+    template = None
+    # How the flags are tested: 'all', 'any' or 'none'.
+    mode = None
+
+    def get_prep_lookup(self):
+        if hasattr(self.rhs, 'resolve_expression'):
+            return self.rhs
+        schema = getattr(self.lhs.output_field, 'schema', None)
+        return get_flags_mask(self.rhs, schema)
 
-        This will be called by Where.as_sql()
-        """
-        engine = connection.settings_dict['ENGINE'].rsplit('.', -1)[-1]
-        if engine.startswith('postgres'):
-            XOR_OPERATOR = '#'
-        elif engine.startswith('sqlite'):
-            raise NotImplementedError
+    def as_sql(self, compiler, connection):
+        if isinstance(self.rhs, int):
+            planned = get_planned_sql(self, compiler, connection, self.rhs, self.mode)
+            if planned is not None:
+                return planned
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        if isinstance(self.rhs, int):
+            # Inline the mask so single flag tests match ``BitFlagIndex``.
+            rhs_sql, rhs_params = '%d' % self.rhs, ()
         else:
-            XOR_OPERATOR = '^'
+            rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        params = list(lhs_params)
+        template = self.get_template()
+        params.extend(list(rhs_params) * template.count('%(rhs)s'))
+        return template % {'lhs': lhs_sql, 'rhs': rhs_sql}, params
+
+    def get_template(self):
+        return self.template
+
+
+class BitHasAllLookup(BitMaskLookup):
+    lookup_name = 'has_all'
+    mode = 'all'
+    template = '(%(lhs)s & %(rhs)s) = %(rhs)s'
+
+
+class BitHasAnyLookup(BitMaskLookup):
+    lookup_name = 'has_any'
+    template = '(%(lhs)s & %(rhs)s) > 0'
+    mode = 'any'
+
+    def get_template(self):
+        if isinstance(self.rhs, int) and self.rhs < 0:
+            # The sign bit makes the masked value negative when set.
+            return '(%(lhs)s & %(rhs)s) <> 0'
+        return self.template
+
+
+class BitHasNoneLookup(BitMaskLookup):
+    lookup_name = 'has_none'
+    template = '(%(lhs)s & %(rhs)s) = 0'
+    mode = 'none'
+
+
+class BitUpdateExpression(Expression):
+    """
+    ``((<expression> | set_mask) & ~clear_mask) ^ toggle_mask``, setting,
+    clearing and toggling several flags in one expression.
+
+    XOR is spelled ``#`` on PostgreSQL and emulated as ``(a | b) - (a & b)``
+    on SQLite, which has no XOR operator.
+    """
+    output_field = BigIntegerField()
+
+    def __init__(self, expression, set_mask=0, clear_mask=0, toggle_mask=0):
+        super(BitUpdateExpression, self).__init__()
+        self.expression = F(expression) if isinstance(expression, str) else expression
+        self.set_mask = int(set_mask)
+        self.clear_mask = int(clear_mask)
+        self.toggle_mask = int(toggle_mask)
+
+    def __repr__(self):
+        return '%s(%r, set_mask=%d, clear_mask=%d, toggle_mask=%d)' % (
+            self.__class__.__name__, self.expression, self.set_mask, self.clear_mask,
+            self.toggle_mask)
+
+    def get_source_expressions(self):
+        return [self.expression]
+
+    def set_source_expressions(self, exprs):
+        self.expression, = exprs
+
+    def xor_sql(self, sql, params, mask, connection):
+        if connection.vendor == 'postgresql':
+            return '(%s # %d)' % (sql, mask), params
+        if connection.vendor == 'sqlite':
+            return '((%s | %d) - (%s & %d))' % (sql, mask, sql, mask), params * 2
+        return '(%s ^ %d)' % (sql, mask), params
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.expression)
+        params = list(params)
+        if self.set_mask:
+            sql = '(%s | %d)' % (sql, self.set_mask)
+        if self.clear_mask:
+            sql = '(%s & %d)' % (sql, ~self.clear_mask)
+        if self.toggle_mask:
+            sql, params = self.xor_sql(sql, params, self.toggle_mask, connection)
+        return sql, params
+
+
+HEX_DIGITS = "'0123456789ABCDEF'"
+
+
+def get_byte_sql(lhs_sql, index, connection):
+    """
+    Return ``(sql, lhs_count)``: an integer expression for byte ``index`` of
+    the binary value ``lhs_sql``, yielding 0 past its end, and how many times
+    ``lhs_sql`` appears in it.
+    """
+    if connection.vendor == 'postgresql':
+        return ('CASE WHEN octet_length(%s) > %d THEN get_byte(%s, %d) ELSE 0 END'
+                % (lhs_sql, index, lhs_sql, index)), 2
+    if connection.vendor == 'sqlite':
+        # SQLite has no function returning a blob's byte: hex() the single
+        # byte, '' past the end, which instr() maps to position 1, i.e. 0.
+        high, low = [
+            '(instr(%s, substr(hex(substr(%s, %d, 1)), %d, 1)) - 1)'
+            % (HEX_DIGITS, lhs_sql, index + 1, position)
+            for position in (1, 2)
+        ]
+        return '(%s * 16 + %s)' % (high, low), 2
+    return 'ASCII(SUBSTRING(%s, %d, 1))' % (lhs_sql, index + 1), 1
+
+
+def get_wide_mask_sql(lhs_sql, lhs_params, mask, mode, connection):
+    """
+    Compile a test of ``mask`` against the binary value ``lhs_sql``, only
+    touching the bytes holding the flags in ``mask``.  ``mode`` is one of
+    ``'all'``, ``'any'`` or ``'none'``.
+    """
+    byte_masks = []
+    index = 0
+    while mask:
+        if mask & 0xFF:
+            byte_masks.append((index, mask & 0xFF))
+        mask >>= 8
+        index += 1
+    if not byte_masks:
+        return ('1 = 0' if mode == 'any' else '1 = 1'), []
+
+    predicates = []
+    params = []
+    for index, byte_mask in byte_masks:
+        byte_sql, lhs_count = get_byte_sql(lhs_sql, index, connection)
+        params.extend(list(lhs_params) * lhs_count)
+        if mode == 'all':
+            predicates.append('(%s & %d) = %d' % (byte_sql, byte_mask, byte_mask))
+        elif mode == 'any':
+            predicates.append('(%s & %d) > 0' % (byte_sql, byte_mask))
+        else:
+            predicates.append('(%s & %d) = 0' % (byte_sql, byte_mask))
+    connector = ' OR ' if mode == 'any' else ' AND '
+    return '(%s)' % connector.join(predicates), params
+
+
+class WideBitQueryLookupWrapper(Exact):
+    """
+    ``flags=Bit(n)`` / ``flags=~Bit(n)`` / ``flags=<BitHandler>`` for
+    ``WideBitField``, testing only the byte(s) holding the flags.
+    """
+    def get_prep_lookup(self):
+        if isinstance(self.rhs, (BitHandler, Bit)):
+            return self.rhs
+        return super(WideBitQueryLookupWrapper, self).get_prep_lookup()
+
+    def as_sql(self, compiler, connection):
+        if not isinstance(self.rhs, (BitHandler, Bit)):
+            return super(WideBitQueryLookupWrapper, self).as_sql(compiler, connection)
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        if isinstance(self.rhs, Bit):
+            mode = 'all' if self.rhs.is_set else 'none'
+            mask = 1 << self.rhs.number
+        else:
+            mode, mask = 'all', self.rhs._value
+        return get_wide_mask_sql(lhs_sql, lhs_params, mask, mode, connection)
+
+
+class WideBitMaskLookup(BitMaskLookup):
+    def as_sql(self, compiler, connection):
+        if not isinstance(self.rhs, int):
+            raise TypeError('%s lookups on a WideBitField need flag values' % self.lookup_name)
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        return get_wide_mask_sql(lhs_sql, lhs_params, self.rhs, self.mode, connection)
+
+
+class WideBitHasAllLookup(WideBitMaskLookup):
+    lookup_name = 'has_all'
+    mode = 'all'
+
+
+class WideBitHasAnyLookup(WideBitMaskLookup):
+    lookup_name = 'has_any'
+    mode = 'any'
+
 
-        if self.bit:
-            return ("%s.%s | %d" % (qn(self.table_alias), qn(self.column), self.bit.mask),
-                    [])
-        return ("%s.%s %s %d" % (qn(self.table_alias), qn(self.column), XOR_OPERATOR, self.bit.mask),
-                [])
+class WideBitHasNoneLookup(WideBitMaskLookup):
+    lookup_name = 'has_none'
+    mode = 'none'
@@ -0,0 +1,137 @@
+"""
+Sidecar tables indexing flag membership as ``(number, row)`` pairs.
+
+For large tables with sparse flags, ``BitField(indexed=[...])`` together
+with a sidecar model keeps one row per set indexed flag, so that both "rows
+with flag X" and "flags of row Y" are index lookups::
+
+    class Article(models.Model):
+        flags = BitField(flags=('is_spam', 'is_featured'), indexed=['is_spam'])
+
+        objects = BitManager()
+
+    ArticleFlagsSidecar = create_sidecar_model(Article, 'flags')
+"""
+from __future__ import absolute_import
+
+import functools
+
+from django.db import connections, models, router, transaction
+from django.db.models.signals import post_save
+
+from bitfield.query import BitFlagExpression
+
+# Number of rows synchronized per query.
+SYNC_BATCH_SIZE = 500
+
+
+def create_sidecar_model(model, field_name, name=None):
+    """
+    Create the sidecar model of ``model.field_name`` and wire the field to
+    it.
+
+    Call it at module level of the app's ``models.py`` so that the sidecar
+    is picked up by migrations like any other model.
+    """
+    field = model._meta.get_field(field_name)
+    if not field.indexed:
+        raise ValueError('%s has no indexed flags' % field_name)
+    if name is None:
+        name = '%s%sSidecar' % (model.__name__, field.name.title().replace('_', ''))
+
+    meta = type('Meta', (), {
+        'app_label': model._meta.app_label,
+        'db_table': '%s_%s_sidecar' % (model._meta.db_table, field.column),
+        'unique_together': (('number', 'row'),),
+    })
+    sidecar = type(name, (models.Model,), {
+        '__module__': model.__module__,
+        'Meta': meta,
+        'number': models.PositiveSmallIntegerField(),
+        'row': models.ForeignKey(model, on_delete=models.CASCADE, related_name='+'),
+    })
+    field.sidecar = sidecar
+    # post_save is sent with the class that was saved, which may be a proxy
+    # or a multi-table child: connect to every sender and filter.
+    post_save.connect(
+        functools.partial(_sync_saved_instance, field), weak=False,
+        dispatch_uid='bitfield.sidecar.%s.%s' % (model._meta.label_lower, field.name))
+    return sidecar
+
+
+def _sync_saved_instance(field, sender, instance, created, raw, using, update_fields, **kwargs):
+    if not issubclass(sender._meta.concrete_model, field.model):
+        return
+    if update_fields is not None and field.name not in update_fields:
+        return
+    value = instance.__dict__.get(field.attname)
+    if created and not hasattr(value, 'resolve_expression'):
+        sync_sidecar(
+            field, [instance.pk], using=using,
+            values={instance.pk: field.to_int(value)}, created=True)
+    else:
+        # Updates only write the changed flags (or an expression): read
+        # back what the database computed.
+        sync_sidecar(field, [instance.pk], using=using)
+
+
+def get_sidecar_fields(model):
+    """
+    Return the BitFields of ``model`` that maintain a sidecar table.
+    """
+    return [f for f in model._meta.concrete_fields if getattr(f, 'sidecar', None) is not None]
+
+
+def sync_sidecar(field, pks, using=None, values=None, created=False):
+    """
+    Bring the sidecar rows of ``pks`` in line with their ``field`` values.
+
+    ``values`` maps primary keys to flag values and is read from the
+    database when omitted.  Rows known to be new (``created``) have nothing
+    to delete.
+    """
+    using = using or router.db_for_write(field.model)
+    numbers = sorted(field.get_indexed_numbers())
+    manager = field.sidecar._base_manager.db_manager(using)
+    pks = list(pks)
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(pks), SYNC_BATCH_SIZE):
+            batch = pks[start:start + SYNC_BATCH_SIZE]
+            if values is None:
+                rows = field.model._base_manager.using(using).filter(pk__in=batch)
+                batch_values = dict(rows.values_list('pk', field.attname))
+            else:
+                batch_values = dict((pk, values.get(pk)) for pk in batch)
+            if not created:
+                manager.filter(row__in=batch).delete()
+            manager.bulk_create([
+                field.sidecar(number=n, row_id=pk)
+                for pk, value in batch_values.items()
+                for n in numbers
+                if field.to_int(value) >> n & 1
+            ])
+
+
+def rebuild_sidecar(field, using=None):
+    """
+    Rebuild the whole sidecar table of ``field`` with one ``INSERT ...
+    SELECT`` per indexed flag.
+    """
+    using = using or router.db_for_write(field.model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = field.sidecar._meta
+    pk = field.model._meta.pk
+    with transaction.atomic(using=using):
+        field.sidecar._base_manager.using(using).all().delete()
+        with connection.cursor() as cursor:
+            for n in sorted(field.get_indexed_numbers()):
+                # Filter on the masked column itself, lookups on indexed
+                # flags would be planned against the sidecar being rebuilt.
+                rows = field.model._base_manager.using(using).annotate(
+                    _bitfield_flag=BitFlagExpression(field.name, 1 << n),
+                ).filter(_bitfield_flag__gt=0).values(pk.attname)
+                sql, params = rows.query.sql_with_params()
+                cursor.execute('INSERT INTO %s (%s, %s) SELECT %d, %s FROM (%s) flagged' % (
+                    qn(opts.db_table), qn(opts.get_field('number').column),
+                    qn(opts.get_field('row').column), n, qn(pk.column), sql), params)
@@ -0,0 +1,21 @@
+from __future__ import absolute_import
+
+from django import template
+
+from bitfield.types import BitHandler, get_set_labels
+
+register = template.Library()
+
+
+@register.filter
+def flag_labels(value, separator=', '):
+    """
+    Render the labels of the flags set in a ``BitHandler``::
+
+        {% load bitfield_tags %}
+        {{ obj.flags|flag_labels }}
+        {{ obj.flags|flag_labels:" / " }}
+    """
+    if not isinstance(value, BitHandler):
+        return ''
+    return separator.join(get_set_labels(value._schema, value._value))
@@ -0,0 +1,143 @@
+"""
+Benchmarks for the hot paths of BitField.
+
+These are not collected by the regular test run. Run them with::
+
+    py.test bitfield/tests/benchmarks.py --benchmark-autosave
+
+and compare against the last saved baseline, failing on regressions, with::
+
+    py.test bitfield/tests/benchmarks.py --benchmark-compare \
+        --benchmark-compare-fail=mean:25%
+
+or simply ``tox -e benchmark``.
+"""
+from __future__ import absolute_import
+
+import pytest
+
+from django.db.models import F
+
+from .models import (
+    BitFieldBenchmark4Model, BitFieldBenchmark32Model, BitFieldBenchmark63Model,
+)
+
+pytest.importorskip('pytest_benchmark')
+
+BULK_SIZE = 500
+
+MODELS = {
+    4: BitFieldBenchmark4Model,
+    32: BitFieldBenchmark32Model,
+    63: BitFieldBenchmark63Model,
+}
+
+
+@pytest.fixture(params=sorted(MODELS), ids=lambda n: '%dflags' % n)
+def model(request):
+    return MODELS[request.param]
+
+
+def _field(model):
+    return model._meta.get_field('flags')
+
+
+def _all_set(model):
+    return (1 << len(_field(model).flags)) - 1
+
+
+def test_flag_getattr(benchmark, model):
+    handler = model(flags=_all_set(model) & 0x5555555555555555).flags
+    keys = list(_field(model).flags)
+
+    def run():
+        for key in keys:
+            getattr(handler, key)
+
+    benchmark(run)
+
+
+def test_flag_setattr(benchmark, model):
+    handler = model(flags=0).flags
+    keys = list(_field(model).flags)
+
+    def run():
+        for key in keys:
+            setattr(handler, key, True)
+            setattr(handler, key, False)
+
+    benchmark(run)
+
+
+def test_handler_iteritems(benchmark, model):
+    handler = model(flags=_all_set(model)).flags
+    benchmark(lambda: list(handler.iteritems()))
+
+
+def test_to_python(benchmark, model):
+    field = _field(model)
+    value = _all_set(model)
+    benchmark(field.to_python, value)
+
+
+def test_to_python_negative(benchmark, model):
+    # Exercises the repair path for the negative values of #1425.
+    field = _field(model)
+    benchmark(field.to_python, -1)
+
+
+def test_flags_iteration(benchmark, model):
+    flags = model.flags
+    benchmark(lambda: list(flags.items()))
+
+
+def test_lookup_compile(benchmark, model):
+    bit = getattr(model.flags, _field(model).flags[-1])
+
+    def run():
+        qs = model.objects.filter(flags=bit).exclude(flags=~bit)
+        return qs.query.get_compiler('default').as_sql()
+
+    benchmark(run)
+
+
+def test_instantiation(benchmark, model):
+    value = _all_set(model)
+    benchmark(lambda: [model(flags=value) for _ in range(100)])
+
+
+def test_from_db(benchmark, model):
+    value = _all_set(model)
+    field_names = [f.attname for f in model._meta.concrete_fields]
+    row = [None if name == 'id' else value for name in field_names]
+
+    benchmark(lambda: [model.from_db('default', field_names, row) for _ in range(100)])
+
+
+@pytest.mark.django_db
+def test_bulk_create(benchmark, model):
+    value = _all_set(model)
+
+    def run():
+        model.objects.bulk_create([model(flags=value) for _ in range(BULK_SIZE)])
+
+    benchmark(run)
+
+
+@pytest.mark.django_db
+def test_update(benchmark, model):
+    model.objects.bulk_create([model(flags=0) for _ in range(BULK_SIZE)])
+    bit = getattr(model.flags, _field(model).flags[-1])
+
+    def run():
+        model.objects.update(flags=F('flags').bitor(bit))
+        model.objects.update(flags=F('flags').bitand(~bit))
+
+    benchmark(run)
+
+
+@pytest.mark.django_db
+def test_iterate_queryset(benchmark, model):
+    model.objects.bulk_create([model(flags=_all_set(model)) for _ in range(BULK_SIZE)])
+
+    benchmark(lambda: list(model.objects.all()))
@@ -1,6 +1,11 @@
+import django
 from django.db import models
 
-from bitfield import BitField, CompositeBitField
+from bitfield import BitField, CompositeBitField, WideBitField
+from bitfield.managers import BitManager
+from bitfield.indexes import BitFlagIndex, BitFlagPartialIndex
+from bitfield.postgres import BitStringField
+from bitfield.sidecar import create_sidecar_model
 
 
 class BitFieldTestModel(models.Model):
@@ -11,6 +16,17 @@ class BitFieldTestModel(models.Model):
         'FLAG_3',
     ), default=3, db_column='another_name')
 
+    objects = BitManager()
+
+
+class BitFieldTestProxy(BitFieldTestModel):
+    class Meta:
+        proxy = True
+
+
+class BitFieldTestChild(BitFieldTestModel):
+    name = models.CharField(max_length=10, default='')
+
 
 class CompositeBitFieldTestModel(models.Model):
     flags_1 = BitField(flags=(
@@ -29,3 +45,73 @@ class CompositeBitFieldTestModel(models.Model):
         'flags_1',
         'flags_2',
     ))
+
+    objects = BitManager()
+
+
+class BitFlagIndexTestModel(models.Model):
+    flags = BitField(flags=(
+        'FLAG_0',
+        'FLAG_1',
+        'FLAG_2',
+    ), default=0)
+
+    class Meta:
+        indexes = [
+            BitFlagIndex('flags', 'FLAG_1'),
+            BitFlagIndex('flags', 2),
+            BitFlagPartialIndex('flags', 'FLAG_0'),
+            BitFlagPartialIndex('flags', 'FLAG_0', fields=['-id']),
+        ]
+
+
+if django.VERSION >= (5, 0):
+    class MaterializedBitFieldTestModel(models.Model):
+        flags = BitField(flags=('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3'), default=0,
+                         materialized=('FLAG_0', 'FLAG_2'))
+else:
+    MaterializedBitFieldTestModel = None
+
+
+class SidecarBitFieldTestModel(models.Model):
+    flags = BitField(flags=('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3'), default=0,
+                     indexed=('FLAG_0', 'FLAG_2'))
+
+    objects = BitManager()
+
+
+SidecarBitFieldTestModelFlagsSidecar = create_sidecar_model(SidecarBitFieldTestModel, 'flags')
+
+
+class SidecarBitFieldTestProxy(SidecarBitFieldTestModel):
+    class Meta:
+        proxy = True
+
+
+class SidecarBitFieldTestChild(SidecarBitFieldTestModel):
+    name = models.CharField(max_length=10, default='')
+
+
+class WideBitFieldTestModel(models.Model):
+    flags = WideBitField(flags=['FLAG_%d' % i for i in range(100)], default=('FLAG_1', 'FLAG_70'))
+
+
+class BitFieldBenchmark4Model(models.Model):
+    flags = BitField(flags=['FLAG_%d' % i for i in range(4)], default=0)
+
+
+class BitFieldBenchmark32Model(models.Model):
+    flags = BitField(flags=['FLAG_%d' % i for i in range(32)], default=0)
+
+
+class BitFieldBenchmark63Model(models.Model):
+    # 63 is the widest field a signed BIGINT can hold.
+    flags = BitField(flags=['FLAG_%d' % i for i in range(63)], default=0)
+
+
+class BitStringFieldTestModel(models.Model):
+    flags = BitStringField(flags=['FLAG_%d' % i for i in range(70)], default=('FLAG_1', 'FLAG_65'))
+    varying_flags = BitStringField(flags=('FLAG_0', 'FLAG_1', 'FLAG_2'), default=0, varying=True)
+
+    class Meta:
+        required_db_vendor = 'postgresql'
@@ -1,15 +1,34 @@
 from __future__ import absolute_import
 
+import json
 import pickle
+import unittest
+from io import StringIO
 
+import django
+from django.core.management import call_command
 from django.db import connection, models
-from django.db.models import F
-from django.test import TestCase
+from django.db.models import F, Q
+from django.template import Context, Engine
+from django.test import RequestFactory, TestCase
 
-from bitfield import BitHandler, Bit, BitField
+from bitfield import BitCount, BitHandler, Bit, BitField, WideBitField, instrumentation
+from bitfield.indexes import BitFlagIndex, BitFlagPartialIndex
+from bitfield.postgres import from_bit_string, get_bit_string_mask_sql, to_bit_string
+from bitfield.types import get_set_labels
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from .forms import BitFieldTestModelForm
-from .models import BitFieldTestModel, CompositeBitFieldTestModel
+from .models import (
+    BitFieldBenchmark63Model, BitFieldTestChild, BitFieldTestModel, BitFieldTestProxy,
+    BitFlagIndexTestModel, BitStringFieldTestModel, CompositeBitFieldTestModel, MaterializedBitFieldTestModel, SidecarBitFieldTestModel,
+    SidecarBitFieldTestChild, SidecarBitFieldTestModelFlagsSidecar, SidecarBitFieldTestProxy,
+    WideBitFieldTestModel,
+)
 
 
 class BitHandlerTest(TestCase):
@@ -93,6 +112,76 @@ class BitHandlerTest(TestCase):
         self.assertEqual(bithandler.FLAG_1, True)
         self.assertEqual(bithandler.FLAG_2, False)
 
+    def test_contains(self):
+        bithandler = BitHandler(5, ('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3'))
+        self.assertTrue('FLAG_0' in bithandler)
+        self.assertFalse('FLAG_1' in bithandler)
+        self.assertTrue('FLAG_2' in bithandler)
+
+    def test_get_label(self):
+        bithandler = BitHandler(0, ('FLAG_0', 'FLAG_1'), ('Flag 0', 'Flag 1'))
+        self.assertEqual(bithandler.get_label('FLAG_1'), 'Flag 1')
+        self.assertEqual(bithandler.get_label(0), 'Flag 0')
+        self.assertEqual(bithandler.get_label(Bit(1)), 'Flag 1')
+
+    def test_slots(self):
+        bithandler = BitHandler(0, ('FLAG_0', 'FLAG_1'))
+        self.assertFalse(hasattr(bithandler, '__dict__'))
+        self.assertRaises(AttributeError, setattr, bithandler, 'FLAG_2', True)
+
+    def test_shared_schema(self):
+        schema = BitFieldTestModel._meta.get_field('flags').schema
+        inst_1 = BitFieldTestModel(flags=1)
+        inst_2 = BitFieldTestModel(flags=2)
+        self.assertIs(inst_1.flags._schema, schema)
+        self.assertIs(inst_2.flags._schema, schema)
+        self.assertIs((inst_1.flags | 4)._schema, schema)
+        self.assertRaises(AttributeError, setattr, schema, 'keys', ())
+
+    def test_legacy_pickle_state(self):
+        bithandler = BitHandler.__new__(BitHandler)
+        bithandler.__setstate__({
+            '_value': 2,
+            '_keys': ['FLAG_0', 'FLAG_1'],
+            '_labels': ['FLAG_0', 'FLAG_1'],
+        })
+        self.assertFalse(bithandler.FLAG_0)
+        self.assertTrue(bithandler.FLAG_1)
+
+    def test_pickle_field_reference(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0101)
+        instance = BitFieldTestModel.objects.get(pk=instance.pk)
+        data = pickle.dumps(instance.flags)
+        self.assertNotIn(b'FLAG_0', data)
+        bithandler = pickle.loads(data)
+        self.assertIs(bithandler._schema, BitFieldTestModel._meta.get_field('flags').schema)
+        self.assertEqual(int(bithandler), 0b0101)
+        instance = pickle.loads(pickle.dumps(instance))
+        self.assertTrue(instance.flags.FLAG_2)
+        self.assertIs(instance.flags._schema, bithandler._schema)
+
+    def test_pickle_unbound(self):
+        bithandler = BitHandler(0b10, ('UNBOUND_0', 'UNBOUND_1'))
+        bithandler = pickle.loads(pickle.dumps(bithandler))
+        self.assertEqual(bithandler.keys(), ('UNBOUND_0', 'UNBOUND_1'))
+        self.assertTrue(bithandler.UNBOUND_1)
+
+    def test_changes(self):
+        bithandler = BitHandler(0b0101, ('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3'))
+        self.assertEqual(bithandler.get_changes(), (0, 0))
+        bithandler.FLAG_1 = True
+        bithandler.FLAG_2 = False
+        bithandler.FLAG_3 = True
+        bithandler.FLAG_3 = False
+        self.assertEqual(bithandler.get_changes(), (0b0010, 0b1100))
+        self.assertEqual(pickle.loads(pickle.dumps(bithandler)).get_changes(), (0b0010, 0b1100))
+        bithandler.reset_changes()
+        self.assertEqual(bithandler.get_changes(), (0, 0))
+
+    def test_count(self):
+        self.assertEqual(BitHandler(0, ('FLAG_0', 'FLAG_1')).count(), 0)
+        self.assertEqual(BitHandler(0b1011, ('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3')).count(), 3)
+
 
 class BitTest(TestCase):
     def test_int(self):
@@ -136,6 +225,26 @@ class BitTest(TestCase):
         self.assertEqual(Bit(0) ^ Bit(5), 33)
         self.assertEqual(Bit(0) ^ ~Bit(2), -6)
 
+    def test_interned(self):
+        self.assertIs(Bit(3), Bit(3))
+        self.assertIs(Bit(3, False), ~Bit(3))
+        self.assertIs(~~Bit(3), Bit(3))
+        self.assertIs(BitFieldTestModel.flags.FLAG_1, Bit(1))
+        bithandler = BitHandler(2, ('FLAG_0', 'FLAG_1'))
+        self.assertIs(bithandler.FLAG_1, Bit(1))
+        self.assertIs(bithandler.FLAG_0, Bit(0, False))
+        self.assertEqual(int(Bit(100)), 2 ** 100)
+
+    def test_immutable(self):
+        bit = Bit(0)
+        self.assertRaises(AttributeError, setattr, bit, 'is_set', False)
+        self.assertRaises(AttributeError, setattr, bit, 'foo', 1)
+        self.assertTrue(bit.is_set)
+
+    def test_pickle(self):
+        self.assertIs(pickle.loads(pickle.dumps(Bit(5))), Bit(5))
+        self.assertIs(pickle.loads(pickle.dumps(~Bit(5))), ~Bit(5))
+
 
 class BitFieldTest(TestCase):
     def test_basic(self):
@@ -293,6 +402,579 @@ class BitFieldTest(TestCase):
         field = TestModel._meta.get_field('flags')
         self.assertEqual(field.default, TestModel.flags.FLAG_1 | TestModel.flags.FLAG_2)
 
+    def test_lazy_handler(self):
+        BitFieldTestModel.objects.create(flags=5)
+        instance = BitFieldTestModel.objects.get()
+        self.assertEqual(instance.__dict__['flags'], 5)
+        field = BitFieldTestModel._meta.get_field('flags')
+        self.assertEqual(field.get_raw_value(instance), 5)
+        self.assertTrue(field.get_raw_value(instance) > 4)
+        self.assertEqual(int(field.get_raw_value(instance)), 5)
+        self.assertEqual(instance.__dict__['flags'], 5)
+        self.assertIsInstance(instance.flags, BitHandler)
+        self.assertEqual(field.get_raw_value(instance), 5)
+        self.assertIs(instance.flags, instance.flags)
+        self.assertTrue(instance.flags.FLAG_2)
+
+    def test_save_without_handler(self):
+        instance = BitFieldTestModel.objects.create(flags=-1)
+        instance = BitFieldTestModel.objects.get(pk=instance.pk)
+        instance.save()
+        self.assertNotIsInstance(instance.__dict__['flags'], BitHandler)
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 15)
+
+        instance.flags = None
+        instance.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0)
+
+        instance.flags = BitFieldTestModel.flags.FLAG_3
+        instance.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 8)
+
+    def test_has_all_any_none(self):
+        BitFieldTestModel.objects.create(flags=3)
+        BitFieldTestModel.objects.create(flags=4)
+        BitFieldTestModel.objects.create(flags=0)
+        qs = BitFieldTestModel.objects.all()
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_0', 'FLAG_1']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_0', 'FLAG_2']).count(), 0)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_0', 'FLAG_2']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_any=[BitFieldTestModel.flags.FLAG_3]).count(), 0)
+        self.assertEqual(qs.filter(flags__has_none=['FLAG_0', 'FLAG_2']).count(), 1)
+        self.assertEqual(qs.exclude(flags__has_none=['FLAG_0', 'FLAG_2']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_all=BitHandler(5, ())).count(), 0)
+        self.assertEqual(qs.filter(flags__has_any='FLAG_2').count(), 1)
+        self.assertRaises(ValueError, qs.filter, flags__has_any=['FLAG_X'])
+
+    def test_save_writes_changed_flags(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0001)
+        other = BitFieldTestModel.objects.get(pk=instance.pk)
+        instance.flags.FLAG_1 = True
+        other.flags.FLAG_0 = False
+        other.flags.FLAG_3 = True
+        instance.save()
+        other.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b1010)
+        self.assertEqual(instance.flags.get_changes(), (0, 0))
+
+    def test_save_unchanged_flags(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0001)
+        other = BitFieldTestModel.objects.get(pk=instance.pk)
+        self.assertTrue(other.flags.FLAG_0)
+        BitFieldTestModel.objects.filter(pk=instance.pk).update(flags=0b0100)
+        other.save()
+        instance.save(update_fields=['flags'])
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b0100)
+
+    def test_save_assigned_value(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0001)
+        BitFieldTestModel.objects.filter(pk=instance.pk).update(flags=0b0110)
+        instance.flags = 0b1000
+        self.assertEqual(type(instance.flags), BitHandler)
+        instance.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b1000)
+        instance.flags = instance.flags | 1
+        instance.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b1001)
+
+    def test_save_after_refresh(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0010)
+        for touch in (False, True):
+            instance = BitFieldTestModel.objects.get(pk=instance.pk)
+            if touch:
+                instance.flags.FLAG_2 = True
+            BitFieldTestModel.objects.filter(pk=instance.pk).update(flags=0b0110)
+            instance.refresh_from_db()
+            self.assertEqual(instance.flags.get_changes(), (0, 0))
+            BitFieldTestModel.objects.filter(pk=instance.pk).update_bits(set=['FLAG_3'])
+            instance.flags.FLAG_0 = True
+            instance.save()
+            self.assertEqual(
+                int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b1111)
+            BitFieldTestModel.objects.filter(pk=instance.pk).update(flags=0b0010)
+        # A value read from another row replaces the stored one.
+        other = BitFieldTestModel.objects.create(flags=0b0001)
+        other = BitFieldTestModel.objects.get(pk=other.pk)
+        instance.flags = other.flags
+        self.assertEqual(instance.flags.get_changes(), (0b0001, ~0b0001))
+        self.assertEqual(other.flags.get_changes(), (0, 0))
+
+    def test_save_through_proxy_and_child(self):
+        for model in (BitFieldTestProxy, BitFieldTestChild):
+            instance = model.objects.create(flags=0)
+            instance.flags.FLAG_1 = True
+            instance.flags.FLAG_2 = True
+            instance.save()
+            self.assertEqual(instance.flags.get_changes(), (0, 0))
+            model.objects.filter(pk=instance.pk).update(flags=0)
+            instance.flags.FLAG_0 = True
+            instance.save()
+            self.assertEqual(int(model.objects.get(pk=instance.pk).flags), 0b0001)
+
+    def test_bulk_operations_reset_changes(self):
+        instance, = BitFieldTestModel.objects.bulk_create([BitFieldTestModel(flags=0b0110)])
+        self.assertEqual(instance.flags.get_changes(), (0, 0))
+        instance.flags.FLAG_3 = True
+        BitFieldTestModel.objects.bulk_update([instance], ['flags'])
+        self.assertEqual(instance.flags.get_changes(), (0, 0))
+        BitFieldTestModel.objects.filter(pk=instance.pk).update(flags=0)
+        instance.flags.FLAG_0 = True
+        instance.save()
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b0001)
+
+    def test_save_changes_not_in_update_fields(self):
+        instance = CompositeBitFieldTestModel.objects.create(flags_1=0, flags_2=0)
+        instance.flags_1.FLAG_2 = True
+        instance.flags_2.FLAG_4 = True
+        instance.save(update_fields=['flags_2'])
+        self.assertEqual(instance.flags_1.get_changes(), (0b0100, 0))
+        self.assertEqual(instance.flags_2.get_changes(), (0, 0))
+        instance.save()
+        instance = CompositeBitFieldTestModel.objects.get(pk=instance.pk)
+        self.assertEqual((int(instance.flags_1), int(instance.flags_2)), (0b0100, 0b0001))
+
+    def test_bitcount(self):
+        BitFieldTestModel.objects.create(flags=0)
+        BitFieldTestModel.objects.create(flags=0b0101)
+        BitFieldTestModel.objects.create(flags=0b1111)
+        qs = BitFieldTestModel.objects.all()
+        self.assertEqual(qs.filter(flags__bitcount__gte=2).count(), 2)
+        self.assertEqual(qs.filter(flags__bitcount=4).count(), 1)
+        self.assertEqual(
+            list(qs.annotate(n=BitCount('flags')).order_by('-n').values_list('n', flat=True)),
+            [4, 2, 0])
+
+    def test_bitcount_wide_values(self):
+        # SWAR fallback over every byte, negative values being repaired.
+        BitFieldBenchmark63Model.objects.create(flags=2 ** 62 | 2 ** 31 | 2 ** 8 | 1)
+        BitFieldBenchmark63Model.objects.create(flags=2 ** 62 - 1)
+        BitFieldBenchmark63Model.objects.create(flags=-1)
+        counts = BitFieldBenchmark63Model.objects.order_by('pk').values_list(
+            BitCount('flags'), flat=True)
+        self.assertEqual(list(counts), [4, 62, 63])
+
+    def test_has_any_single_predicate(self):
+        qs = BitFieldTestModel.objects.filter(flags__has_any=['FLAG_0', 'FLAG_1', 'FLAG_3'])
+        sql, params = qs.query.get_compiler(qs.db).as_sql()
+        self.assertEqual(sql.count('&'), 1)
+        self.assertIn('& 11) > 0', sql)
+
+
+@unittest.skipIf(MaterializedBitFieldTestModel is None, 'generated columns need Django 5.0+')
+class MaterializedFlagTest(TestCase):
+    def test_generated_columns(self):
+        names = [f.name for f in MaterializedBitFieldTestModel._meta.concrete_fields]
+        self.assertEqual(names, ['id', 'flags', 'flags_FLAG_0', 'flags_FLAG_2'])
+        column = MaterializedBitFieldTestModel._meta.get_field('flags_FLAG_2')
+        self.assertTrue(column.db_index)
+        instance = MaterializedBitFieldTestModel.objects.create(flags=0b0101)
+        instance = MaterializedBitFieldTestModel.objects.get(pk=instance.pk)
+        self.assertTrue(instance.flags_FLAG_0)
+        self.assertTrue(instance.flags_FLAG_2)
+        instance.flags.FLAG_2 = False
+        instance.save()
+        instance.refresh_from_db()
+        self.assertFalse(instance.flags_FLAG_2)
+
+    def test_select(self):
+        MaterializedBitFieldTestModel.objects.create(flags=0b0001)
+        MaterializedBitFieldTestModel.objects.create(flags=0b0101)
+        MaterializedBitFieldTestModel.objects.create(flags=0b1010)
+        qs = MaterializedBitFieldTestModel.objects.all()
+        flags = MaterializedBitFieldTestModel.flags
+        self.assertEqual(qs.filter(flags=flags.FLAG_0).count(), 2)
+        self.assertEqual(qs.filter(flags=~flags.FLAG_2).count(), 2)
+        self.assertEqual(qs.exclude(flags=flags.FLAG_2).count(), 2)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_0', 'FLAG_2']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_0', 'FLAG_2']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_none=['FLAG_0', 'FLAG_2']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_1', 'FLAG_2']).count(), 2)
+
+    def test_lookup_targets_generated_column(self):
+        qs = MaterializedBitFieldTestModel.objects.filter(flags=MaterializedBitFieldTestModel.flags.FLAG_0)
+        sql, params = qs.query.get_compiler(qs.db).as_sql()
+        self.assertIn('"flags_FLAG_0" = %s', sql)
+        self.assertNotIn('&', sql)
+        qs = MaterializedBitFieldTestModel.objects.filter(flags__has_any=['FLAG_0', 'FLAG_2'])
+        sql, params = qs.query.get_compiler(qs.db).as_sql()
+        self.assertIn('"flags_FLAG_0" = %s OR ', sql)
+        # FLAG_1 is not materialized.
+        qs = MaterializedBitFieldTestModel.objects.filter(flags__has_all=['FLAG_0', 'FLAG_1'])
+        self.assertIn('& 3', str(qs.query))
+
+    def test_deconstruct(self):
+        field = MaterializedBitFieldTestModel._meta.get_field('flags')
+        name, path, args, kwargs = field.deconstruct()
+        self.assertEqual(kwargs['materialized'], ('FLAG_0', 'FLAG_2'))
+        column = MaterializedBitFieldTestModel._meta.get_field('flags_FLAG_2')
+        name, path, args, kwargs = column.deconstruct()
+        self.assertEqual(path, 'bitfield.generated.MaterializedFlagField')
+        self.assertEqual(args, ['flags', 2])
+        self.assertEqual(kwargs, {})
+
+    def test_model_state_round_trip(self):
+        from django.db.migrations.state import ModelState
+        state = ModelState.from_model(MaterializedBitFieldTestModel)
+        self.assertEqual(list(state.fields), ['id', 'flags', 'flags_FLAG_0', 'flags_FLAG_2'])
+        from django.apps.registry import Apps
+        model = state.render(Apps())
+        self.assertEqual(
+            [f.name for f in model._meta.concrete_fields],
+            ['id', 'flags', 'flags_FLAG_0', 'flags_FLAG_2'])
+
+    def test_invalid_flag(self):
+        with self.assertRaises(ValueError):
+            BitField(flags=('FLAG_0',), materialized=('FLAG_9',))
+
+    def test_positional_field_arguments(self):
+        field = BitField(('FLAG_0',), 0, 'My flags')
+        self.assertEqual(field.verbose_name, 'My flags')
+        self.assertEqual((field.materialized, field.indexed), ((), ()))
+
+
+class SidecarTest(TestCase):
+    def get_pairs(self):
+        return sorted(SidecarBitFieldTestModelFlagsSidecar.objects.values_list('row_id', 'number'))
+
+    def test_sync_on_save(self):
+        instance = SidecarBitFieldTestModel.objects.create(flags=0b0111)
+        self.assertEqual(self.get_pairs(), [(instance.pk, 0), (instance.pk, 2)])
+        instance.flags.FLAG_0 = False
+        instance.save()
+        self.assertEqual(self.get_pairs(), [(instance.pk, 2)])
+        instance.flags = F('flags').bitor(1)
+        instance.save()
+        self.assertEqual(self.get_pairs(), [(instance.pk, 0), (instance.pk, 2)])
+        instance.delete()
+        self.assertEqual(self.get_pairs(), [])
+
+    def test_sync_on_proxy_and_child_save(self):
+        proxied = SidecarBitFieldTestProxy.objects.create(flags=0b0001)
+        child = SidecarBitFieldTestChild.objects.create(flags=0b0100)
+        self.assertEqual(self.get_pairs(), [(proxied.pk, 0), (child.pk, 2)])
+        child.flags.FLAG_0 = True
+        child.save()
+        self.assertEqual(self.get_pairs(), [(proxied.pk, 0), (child.pk, 0), (child.pk, 2)])
+        flag = SidecarBitFieldTestModel.flags.FLAG_0
+        self.assertEqual(SidecarBitFieldTestModel.objects.filter(flags=flag).count(), 2)
+        self.assertEqual(SidecarBitFieldTestChild.objects.filter(flags=flag).count(), 1)
+
+    def test_check_manager(self):
+        from django.test.utils import isolate_apps
+
+        field = SidecarBitFieldTestModel._meta.get_field('flags')
+        self.assertEqual(field.check(), [])
+        with isolate_apps('bitfield.tests'):
+            class PlainManagerModel(models.Model):
+                flags = BitField(flags=('FLAG_0',), indexed=('FLAG_0',))
+
+            field = PlainManagerModel._meta.get_field('flags')
+            self.assertEqual(field.check(), [])
+            field.sidecar = SidecarBitFieldTestModelFlagsSidecar
+            self.assertEqual([error.id for error in field.check()], ['bitfield.E001'])
+
+    def test_sync_on_bulk_operations(self):
+        a, b = SidecarBitFieldTestModel.objects.bulk_create([
+            SidecarBitFieldTestModel(flags=0b0001),
+            SidecarBitFieldTestModel(flags=0b0100),
+        ])
+        self.assertEqual(self.get_pairs(), [(a.pk, 0), (b.pk, 2)])
+        qs = SidecarBitFieldTestModel.objects
+        qs.filter(flags=SidecarBitFieldTestModel.flags.FLAG_0).update_bits(
+            set=['FLAG_2'], clear=['FLAG_0'])
+        self.assertEqual(self.get_pairs(), [(a.pk, 2), (b.pk, 2)])
+        qs.all().update(flags=1)
+        self.assertEqual(self.get_pairs(), [(a.pk, 0), (b.pk, 0)])
+        a.flags = 0b0101
+        qs.bulk_update([a], ['flags'])
+        self.assertEqual(self.get_pairs(), [(a.pk, 0), (a.pk, 2), (b.pk, 0)])
+
+    def test_select(self):
+        SidecarBitFieldTestModel.objects.create(flags=0b0001)
+        SidecarBitFieldTestModel.objects.create(flags=0b0101)
+        SidecarBitFieldTestModel.objects.create(flags=0b1010)
+        qs = SidecarBitFieldTestModel.objects.all()
+        flags = SidecarBitFieldTestModel.flags
+        self.assertEqual(qs.filter(flags=flags.FLAG_0).count(), 2)
+        self.assertEqual(qs.filter(flags=~flags.FLAG_2).count(), 2)
+        self.assertEqual(qs.exclude(flags=flags.FLAG_2).count(), 2)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_0', 'FLAG_2']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_0', 'FLAG_2']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_none=['FLAG_0', 'FLAG_2']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_1', 'FLAG_2']).count(), 2)
+
+    def test_lookup_is_semi_join(self):
+        qs = SidecarBitFieldTestModel.objects.filter(flags=SidecarBitFieldTestModel.flags.FLAG_2)
+        sql = str(qs.query)
+        self.assertIn('IN (SELECT "row_id" FROM "%s" WHERE "number" = 2)'
+                      % SidecarBitFieldTestModelFlagsSidecar._meta.db_table, sql)
+        self.assertNotIn('&', sql)
+        # FLAG_1 is not indexed.
+        qs = SidecarBitFieldTestModel.objects.filter(flags__has_any=['FLAG_0', 'FLAG_1'])
+        self.assertIn('& 3', str(qs.query))
+
+    def test_rebuild_command(self):
+        a = SidecarBitFieldTestModel.objects.create(flags=0b0101)
+        b = SidecarBitFieldTestModel.objects.create(flags=0b0100)
+        SidecarBitFieldTestModelFlagsSidecar.objects.all().delete()
+        SidecarBitFieldTestModelFlagsSidecar.objects.create(row=b, number=0)
+        out = StringIO()
+        call_command('rebuild_bitfield_sidecars', 'tests.SidecarBitFieldTestModel', stdout=out)
+        self.assertIn(SidecarBitFieldTestModelFlagsSidecar._meta.db_table, out.getvalue())
+        self.assertEqual(self.get_pairs(), [(a.pk, 0), (a.pk, 2), (b.pk, 2)])
+
+    def test_deconstruct(self):
+        field = SidecarBitFieldTestModel._meta.get_field('flags')
+        self.assertEqual(field.deconstruct()[3]['indexed'], ('FLAG_0', 'FLAG_2'))
+
+    def test_partial_index(self):
+        index = BitFlagPartialIndex('flags', 'FLAG_0')
+        index.set_name_with_model(SidecarBitFieldTestModel)
+        sql = str(index.create_sql(SidecarBitFieldTestModel, connection.schema_editor()))
+        self.assertNotIn('SELECT', sql)
+        if connection.features.supports_partial_indexes:
+            self.assertIn('& 1) > 0', sql)
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+        # Queries still use the sidecar.
+        qs = SidecarBitFieldTestModel.objects.filter(flags=SidecarBitFieldTestModel.flags.FLAG_0)
+        self.assertIn('SELECT', str(qs.query).split('WHERE', 1)[1])
+
+
+class WideBitFieldTest(TestCase):
+    def test_default(self):
+        instance = WideBitFieldTestModel.objects.create()
+        instance = WideBitFieldTestModel.objects.get(pk=instance.pk)
+        self.assertEqual(type(instance.flags), BitHandler)
+        self.assertTrue(instance.flags.FLAG_1)
+        self.assertTrue(instance.flags.FLAG_70)
+        self.assertFalse(instance.flags.FLAG_99)
+        self.assertEqual(int(instance.flags), 2 | 2 ** 70)
+
+    def test_save(self):
+        instance = WideBitFieldTestModel.objects.create(flags=0)
+        instance.flags.FLAG_99 = True
+        instance.flags.FLAG_3 = True
+        instance.save()
+        instance = WideBitFieldTestModel.objects.get(pk=instance.pk)
+        self.assertEqual(int(instance.flags), 2 ** 99 | 8)
+        self.assertEqual(WideBitFieldTestModel.objects.values_list('flags', flat=True).get(), 2 ** 99 | 8)
+        cursor = connection.cursor()
+        cursor.execute('SELECT flags FROM %s' % WideBitFieldTestModel._meta.db_table)
+        self.assertEqual(bytes(cursor.fetchone()[0]), (2 ** 99 | 8).to_bytes(13, 'little'))
+
+    def test_select(self):
+        WideBitFieldTestModel.objects.create(flags=0)
+        WideBitFieldTestModel.objects.create(flags=2 ** 70 | 2 ** 8)
+        WideBitFieldTestModel.objects.create(flags=2 ** 99 | 1)
+        qs = WideBitFieldTestModel.objects.all()
+        flags = WideBitFieldTestModel.flags
+        self.assertEqual(qs.filter(flags=flags.FLAG_70).count(), 1)
+        self.assertEqual(qs.filter(flags=~flags.FLAG_70).count(), 2)
+        self.assertEqual(qs.exclude(flags=flags.FLAG_99).count(), 2)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_70', 'FLAG_8']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_70', 'FLAG_0']).count(), 0)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_70', 'FLAG_0']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_none=['FLAG_70', 'FLAG_99']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=[]).count(), 0)
+        self.assertEqual(qs.filter(flags=2 ** 99 | 1).count(), 1)
+
+    def test_lookup_reads_single_byte(self):
+        qs = WideBitFieldTestModel.objects.filter(flags=WideBitFieldTestModel.flags.FLAG_70)
+        sql = str(qs.query)
+        if connection.vendor == 'sqlite':
+            # Only byte 8 is hex encoded.
+            self.assertIn('hex(substr("tests_widebitfieldtestmodel"."flags", 9, 1))', sql)
+            self.assertNotIn('hex("tests_widebitfieldtestmodel"."flags")', sql)
+
+    def test_shorter_stored_value(self):
+        cursor = connection.cursor()
+        table = WideBitFieldTestModel._meta.db_table
+        cursor.execute("INSERT INTO %s (flags) VALUES (%%s)" % table, [b'\x02'])
+        instance = WideBitFieldTestModel.objects.get()
+        self.assertTrue(instance.flags.FLAG_1)
+        self.assertFalse(WideBitFieldTestModel.objects.filter(flags__has_any=['FLAG_99']).exists())
+        self.assertTrue(WideBitFieldTestModel.objects.filter(flags__has_any=['FLAG_1']).exists())
+
+    def test_deconstruct(self):
+        field = WideBitFieldTestModel._meta.get_field('flags')
+        name, path, args, kwargs = field.deconstruct()
+        self.assertEqual(path, 'bitfield.models.WideBitField')
+        self.assertEqual(len(args[0]), 100)
+        self.assertNotIn('editable', kwargs)
+        self.assertEqual(kwargs['default'], 2 | 2 ** 70)
+        self.assertEqual(WideBitField(*args, **kwargs).num_bytes, 13)
+
+
+class BitStringFieldTest(TestCase):
+    def test_bit_string_conversion(self):
+        self.assertEqual(to_bit_string(0b1101, 6), '101100')
+        self.assertEqual(from_bit_string('101100'), 0b1101)
+        self.assertEqual(from_bit_string(''), 0)
+        self.assertEqual(from_bit_string(to_bit_string(2 ** 69 | 1, 70)), 2 ** 69 | 1)
+
+    def test_mask_sql(self):
+        self.assertEqual(get_bit_string_mask_sql('"flags"', 0b011, 3, 'all'), "(\"flags\" & B'110') = B'110'")
+        self.assertEqual(get_bit_string_mask_sql('"flags"', 0b100, 3, 'any'), "(\"flags\" & B'001') <> B'000'")
+        self.assertEqual(get_bit_string_mask_sql('"flags"', 0b100, 3, 'none'), "(\"flags\" & B'001') = B'000'")
+
+    def test_field(self):
+        field = BitStringFieldTestModel._meta.get_field('flags')
+        self.assertEqual(field.db_type(connection), 'bit(70)')
+        self.assertEqual(BitStringFieldTestModel._meta.get_field('varying_flags').db_type(connection), 'bit varying(3)')
+        self.assertEqual(field.get_prep_value(Bit(2)), '001' + '0' * 67)
+        handler = field.to_python(field.from_db_value('01' + '0' * 68, None, connection))
+        self.assertEqual(type(handler), BitHandler)
+        self.assertTrue(handler.FLAG_1)
+        self.assertFalse(handler.FLAG_0)
+        instance = BitStringFieldTestModel()
+        self.assertTrue(instance.flags.FLAG_65)
+        self.assertEqual(int(instance.flags), 2 | 2 ** 65)
+
+    def test_deconstruct(self):
+        field = BitStringFieldTestModel._meta.get_field('varying_flags')
+        name, path, args, kwargs = field.deconstruct()
+        self.assertEqual(path, 'bitfield.postgres.BitStringField')
+        self.assertEqual(args[0], ('FLAG_0', 'FLAG_1', 'FLAG_2'))
+        self.assertTrue(kwargs['varying'])
+        self.assertNotIn('varying', BitStringFieldTestModel._meta.get_field('flags').deconstruct()[3])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'bit strings are PostgreSQL specific')
+    def test_select(self):
+        BitStringFieldTestModel.objects.create(flags=0)
+        BitStringFieldTestModel.objects.create(flags=2 ** 69 | 2 ** 8, varying_flags=0b100)
+        BitStringFieldTestModel.objects.create(flags=1)
+        qs = BitStringFieldTestModel.objects.all()
+        flags = BitStringFieldTestModel.flags
+        self.assertEqual(qs.filter(flags=flags.FLAG_69).count(), 1)
+        self.assertEqual(qs.filter(flags=~flags.FLAG_69).count(), 2)
+        self.assertEqual(qs.filter(flags__has_all=['FLAG_69', 'FLAG_8']).count(), 1)
+        self.assertEqual(qs.filter(flags__has_any=['FLAG_69', 'FLAG_0']).count(), 2)
+        self.assertEqual(qs.filter(flags__has_none=['FLAG_69', 'FLAG_0']).count(), 1)
+        self.assertEqual(qs.filter(varying_flags=BitStringFieldTestModel.varying_flags.FLAG_2).count(), 1)
+        instance = qs.get(flags=1)
+        instance.flags.FLAG_68 = True
+        instance.save()
+        self.assertEqual(int(qs.get(pk=instance.pk).flags), 2 ** 68 | 1)
+
+
+class BitQuerySetTest(TestCase):
+    def test_update_bits(self):
+        instance = BitFieldTestModel.objects.create(flags=0b0101)
+        other = BitFieldTestModel.objects.create(flags=0)
+
+        qs = BitFieldTestModel.objects.filter(pk=instance.pk)
+        self.assertEqual(qs.update_bits(set=['FLAG_1'], clear=[BitFieldTestModel.flags.FLAG_0]), 1)
+        self.assertEqual(int(qs.get().flags), 0b0110)
+
+        qs.update_bits('flags', toggle=['FLAG_1', 'FLAG_3'])
+        self.assertEqual(int(qs.get().flags), 0b1100)
+
+        qs.update_bits(set='FLAG_0', clear='FLAG_2', toggle=BitHandler(0b1001, ()))
+        self.assertEqual(int(qs.get().flags), 0b0000)
+
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=other.pk).flags), 0)
+
+    def test_update_bits_single_statement(self):
+        instance = BitFieldTestModel.objects.create(flags=0)
+        with self.assertNumQueries(1):
+            BitFieldTestModel.objects.filter(pk=instance.pk).update_bits(
+                set=['FLAG_0', 'FLAG_1'], clear=['FLAG_2'], toggle=['FLAG_1', 'FLAG_3'])
+        self.assertEqual(int(BitFieldTestModel.objects.get(pk=instance.pk).flags), 0b1001)
+
+    def test_update_bits_field_name(self):
+        instance = CompositeBitFieldTestModel.objects.create()
+        qs = CompositeBitFieldTestModel.objects.filter(pk=instance.pk)
+        self.assertRaises(TypeError, qs.update_bits, set=['FLAG_0'])
+        self.assertRaises(TypeError, qs.update_bits, 'id', set=[1])
+        self.assertRaises(ValueError, qs.update_bits, 'flags_1', set=['FLAG_4'])
+        qs.update_bits('flags_2', set=['FLAG_4'])
+        self.assertTrue(qs.get().flags.FLAG_4)
+        self.assertEqual(CompositeBitFieldTestModel.objects.flag_counts('flags_2', labels=True), {
+            'FLAG_4': 1, 'FLAG_5': 0, 'FLAG_6': 0, 'FLAG_7': 0,
+        })
+
+    @unittest.skipIf(django.VERSION < (4, 1), 'async queryset API needs Django 4.1+')
+    async def test_async_bit_operations(self):
+        instance = await BitFieldTestModel.objects.acreate(flags=0b0101)
+        rows = await BitFieldTestModel.objects.filter(pk=instance.pk).aupdate_bits(
+            set=['FLAG_1'], clear=['FLAG_0'])
+        self.assertEqual(rows, 1)
+        instance = await BitFieldTestModel.objects.aget(pk=instance.pk)
+        self.assertEqual(int(instance.flags), 0b0110)
+        counts = await BitFieldTestModel.objects.aflag_counts(labels=True)
+        self.assertEqual(counts, {'FLAG_0': 0, 'FLAG_1': 1, 'FLAG_2': 1, 'FLAG_3': 0})
+
+    def test_flag_counts(self):
+        for value in (0b0001, 0b0011, 0b0110, 0):
+            BitFieldTestModel.objects.create(flags=value)
+        with self.assertNumQueries(1):
+            counts = BitFieldTestModel.objects.flag_counts()
+        self.assertEqual(counts, {'FLAG_0': 2, 'FLAG_1': 2, 'FLAG_2': 1, 'FLAG_3': 0})
+        self.assertEqual(
+            BitFieldTestModel.objects.filter(flags=BitFieldTestModel.flags.FLAG_2).flag_counts('flags'),
+            {'FLAG_0': 0, 'FLAG_1': 1, 'FLAG_2': 1, 'FLAG_3': 0})
+        self.assertEqual(
+            BitFieldTestModel.objects.none().flag_counts(),
+            {'FLAG_0': 0, 'FLAG_1': 0, 'FLAG_2': 0, 'FLAG_3': 0})
+
+
+class BitFlagIndexTest(TestCase):
+    def test_name(self):
+        index = BitFlagIndexTestModel._meta.indexes[0]
+        self.assertTrue(index.name.endswith('_bit'))
+        self.assertLessEqual(len(index.name), index.max_name_length)
+        self.assertNotEqual(index.name, BitFlagIndexTestModel._meta.indexes[1].name)
+
+    def test_deconstruct(self):
+        index = BitFlagIndex('flags', BitFlagIndexTestModel.flags.FLAG_2, name='test_idx')
+        path, args, kwargs = index.deconstruct()
+        self.assertEqual(path, 'bitfield.indexes.BitFlagIndex')
+        self.assertEqual(args, ())
+        self.assertEqual(kwargs, {'field': 'flags', 'flag': 2, 'name': 'test_idx'})
+        self.assertEqual(index.clone(), index)
+
+    def test_lookup_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN output is SQLite specific')
+        index = BitFlagIndexTestModel._meta.indexes[0]
+        for qs in (
+            BitFlagIndexTestModel.objects.filter(flags=BitFlagIndexTestModel.flags.FLAG_1),
+            BitFlagIndexTestModel.objects.filter(flags=~BitFlagIndexTestModel.flags.FLAG_1),
+            BitFlagIndexTestModel.objects.filter(flags__has_any=['FLAG_1']),
+            BitFlagIndexTestModel.objects.filter(flags__has_none=['FLAG_1']),
+        ):
+            self.assertIn(index.name, qs.explain())
+            self.assertFalse(qs.exists())
+
+
+class BitFlagPartialIndexTest(TestCase):
+    def test_deconstruct(self):
+        index = BitFlagPartialIndex('flags', 'FLAG_0', fields=['-id'], name='test_idx')
+        path, args, kwargs = index.deconstruct()
+        self.assertEqual(path, 'bitfield.indexes.BitFlagPartialIndex')
+        self.assertEqual(kwargs, {'field': 'flags', 'flag': 'FLAG_0', 'fields': ['-id'], 'name': 'test_idx'})
+        self.assertEqual(index.clone(), index)
+
+    def test_create_sql(self):
+        index = BitFlagIndexTestModel._meta.indexes[2]
+        editor = connection.schema_editor()
+        sql = str(index.create_sql(BitFlagIndexTestModel, editor))
+        self.assertIn('& 1) > 0', sql)
+        if connection.features.supports_partial_indexes:
+            self.assertIn('WHERE', sql)
+
+    def test_lookup_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN output is SQLite specific')
+        index_names = [index.name for index in BitFlagIndexTestModel._meta.indexes[2:]]
+        for qs in (
+            BitFlagIndexTestModel.objects.filter(flags=BitFlagIndexTestModel.flags.FLAG_0).order_by('-pk'),
+            BitFlagIndexTestModel.objects.filter(flags__has_any=['FLAG_0'], pk__gt=10),
+        ):
+            plan = qs.explain()
+            self.assertTrue(any(name in plan for name in index_names), plan)
+
 
 class BitFieldSerializationTest(TestCase):
     def test_can_unserialize_bithandler(self):
@@ -357,6 +1039,34 @@ class CompositeBitFieldTest(TestCase):
         self.assertEqual(hasattr(inst.flags, 'flag_4'),
             hasattr(inst.flags_2, 'flag_4'))
 
+    def test_routes(self):
+        field = CompositeBitFieldTestModel.flags
+        self.assertEqual(field.routes['FLAG_1'], ('flags_1', 2))
+        self.assertEqual(field.routes['FLAG_6'], ('flags_2', 4))
+
+    def test_filter(self):
+        CompositeBitFieldTestModel.objects.create(flags_1=0b0011, flags_2=0b0001)
+        CompositeBitFieldTestModel.objects.create(flags_1=0b0001, flags_2=0b0000)
+        CompositeBitFieldTestModel.objects.create(flags_1=0b0000, flags_2=0b0100)
+        objects = CompositeBitFieldTestModel.objects
+        self.assertEqual(objects.filter(flags__has_all=['FLAG_0', 'FLAG_1', 'FLAG_4']).count(), 1)
+        self.assertEqual(objects.filter(flags__has_all=['FLAG_0']).count(), 2)
+        self.assertEqual(objects.filter(flags__has_any=['FLAG_1', 'FLAG_6']).count(), 2)
+        self.assertEqual(objects.filter(flags__has_any=[]).count(), 0)
+        self.assertEqual(objects.filter(flags__has_none=['FLAG_0', 'FLAG_4']).count(), 1)
+        self.assertEqual(objects.exclude(flags__has_any=['FLAG_6']).count(), 2)
+        self.assertEqual(objects.filter(Q(flags__has_any=['FLAG_6']) | Q(flags_1=3)).count(), 2)
+        self.assertEqual(int(objects.get(flags__has_all='FLAG_6').flags_2), 4)
+        self.assertRaises(ValueError, objects.filter, flags__has_all=['FLAG_NA'])
+
+    def test_filter_merges_masks(self):
+        qs = CompositeBitFieldTestModel.objects.filter(
+            flags__has_any=['FLAG_0', 'FLAG_2', 'FLAG_3', 'FLAG_5'])
+        sql = str(qs.query)
+        self.assertEqual(sql.count('&'), 2)
+        self.assertIn('& 13)', sql)
+        self.assertIn('& 2)', sql)
+
 
 class BitFormFieldTest(TestCase):
     def test_form_new_invalid(self):
@@ -409,3 +1119,412 @@ class BitFormFieldTest(TestCase):
         instance = form.save()
         for k in BitFieldTestModel.flags:
             self.assertFalse(bool(getattr(instance.flags, k)))
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class NumpyExportTest(TestCase):
+    def test_to_array(self):
+        from bitfield.numpy import to_array
+
+        for value in (1, 15, 6, 0):
+            BitFieldTestModel.objects.create(flags=value)
+        cursor = connection.cursor()
+        flags_field = BitFieldTestModel._meta.get_field('flags')
+        cursor.execute("INSERT INTO %s (%s) VALUES (-1)" % (BitFieldTestModel._meta.db_table, flags_field.db_column))
+
+        values = to_array(BitFieldTestModel.objects.order_by('pk'), 'flags', chunk_size=2)
+        self.assertEqual(values.dtype, numpy.uint64)
+        self.assertEqual(values.tolist(), [1, 15, 6, 0, 15])
+        self.assertEqual(to_array(BitFieldTestModel.objects.none(), 'flags').tolist(), [])
+        self.assertRaises(TypeError, to_array, BitFieldTestModel.objects.all(), 'id')
+
+    def test_to_flag_matrix(self):
+        from bitfield.numpy import to_flag_matrix
+
+        for value in (1, 5, 6):
+            BitFieldTestModel.objects.create(flags=value)
+        matrix, flags = to_flag_matrix(BitFieldTestModel.objects.order_by('pk'), 'flags')
+        self.assertEqual(flags, ('FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3'))
+        self.assertEqual(matrix.dtype, bool)
+        self.assertEqual(matrix.tolist(), [
+            [True, False, False, False],
+            [True, False, True, False],
+            [False, True, True, False],
+        ])
+        self.assertEqual(matrix.sum(axis=0).tolist(), [2, 1, 2, 0])
+
+
+class FakeChangeList(object):
+    pk_attname = 'id'
+
+    def __init__(self, queryset, params):
+        self.queryset = queryset
+        self.params = params
+
+    def get_query_string(self, new_params=None, remove=None):
+        params = dict(self.params)
+        for key in remove or []:
+            params.pop(key, None)
+        params.update(new_params or {})
+        return '?' + '&'.join('%s=%s' % item for item in sorted(params.items()))
+
+
+class BitFieldListFilterTest(TestCase):
+    def get_filter(self, params):
+        from bitfield.admin import BitFieldListFilter
+
+        request = RequestFactory().get('/', params)
+        field = BitFieldTestModel._meta.get_field('flags')
+        return BitFieldListFilter(
+            field, request, dict((k, [v]) for k, v in params.items()),
+            BitFieldTestModel, None, 'flags')
+
+    def get_changelist(self, list_filter, params):
+        queryset = list_filter.queryset(None, BitFieldTestModel.objects.all())
+        return FakeChangeList(queryset, params)
+
+    def setUp(self):
+        for value in (0b0001, 0b0011, 0b0110, 0):
+            BitFieldTestModel.objects.create(flags=value)
+
+    def test_all(self):
+        params = {'flags': '3'}
+        list_filter = self.get_filter(params)
+        qs = list_filter.queryset(None, BitFieldTestModel.objects.all())
+        self.assertEqual(qs.count(), 1)
+
+        cl = self.get_changelist(list_filter, params)
+        with self.assertNumQueries(1):
+            choices = list(list_filter.choices(cl))
+        self.assertEqual([c['display'] for c in choices[1:5]], [
+            'FLAG_0 (1)', 'FLAG_1 (1)', 'FLAG_2 (0)', 'FLAG_3 (0)',
+        ])
+        self.assertEqual([c['selected'] for c in choices[:5]], [False, True, True, False, False])
+        # Clicking a selected flag removes it from the mask.
+        self.assertEqual(choices[1]['query_string'], '?flags=2')
+        self.assertEqual(choices[3]['query_string'], '?flags=7')
+        self.assertEqual(choices[-2]['display'], 'Match all selected')
+        self.assertTrue(choices[-2]['selected'])
+        self.assertEqual(choices[-1]['query_string'], '?flags__has_any=3')
+
+    def test_any(self):
+        params = {'flags__has_any': '5'}
+        list_filter = self.get_filter(params)
+        qs = list_filter.queryset(None, BitFieldTestModel.objects.all())
+        self.assertEqual(qs.count(), 3)
+
+        choices = list(list_filter.choices(self.get_changelist(list_filter, params)))
+        self.assertEqual(choices[1]['query_string'], '?flags__has_any=4')
+        self.assertTrue(choices[-1]['selected'])
+
+    def test_no_selection(self):
+        list_filter = self.get_filter({})
+        self.assertEqual(list_filter.queryset(None, BitFieldTestModel.objects.all()).count(), 4)
+        choices = list(list_filter.choices(self.get_changelist(list_filter, {})))
+        self.assertTrue(choices[0]['selected'])
+        self.assertEqual(len(choices), 5)
+        self.assertEqual(choices[2]['display'], 'FLAG_1 (2)')
+
+
+class FlagLabelsTest(TestCase):
+    def test_render_labels(self):
+        field = BitFieldTestModel._meta.get_field('flags')
+        self.assertEqual(field.get_set_labels(0b0101), ('FLAG_0', 'FLAG_2'))
+        self.assertEqual(field.render_labels(BitHandler(0b1001, field.schema)), 'FLAG_0, FLAG_3')
+        self.assertEqual(field.render_labels(0, ' | '), '')
+        get_set_labels.cache_clear()
+        for _ in range(10):
+            field.render_labels(0b0110)
+        info = get_set_labels.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 9))
+
+    def test_admin_column(self):
+        from bitfield.admin import flag_labels_column
+
+        column = flag_labels_column('flags', 'Flags', separator='/')
+        self.assertEqual(column.short_description, 'Flags')
+        BitFieldTestModel.objects.create(flags=0b0011)
+        instance = BitFieldTestModel.objects.get()
+        self.assertEqual(column(instance), 'FLAG_0/FLAG_1')
+        self.assertNotIsInstance(instance.__dict__['flags'], BitHandler)
+        instance.flags.FLAG_3 = True
+        self.assertEqual(column(instance), 'FLAG_0/FLAG_1/FLAG_3')
+
+    def test_template_filter(self):
+        instance = BitFieldTestModel(flags=0b0110)
+        engine = Engine(libraries={'bitfield_tags': 'bitfield.templatetags.bitfield_tags'})
+        rendered = engine.from_string(
+            '{% load bitfield_tags %}{{ obj.flags|flag_labels }}|{{ obj.flags|flag_labels:" + " }}'
+        ).render(Context({'obj': instance}))
+        self.assertEqual(rendered, 'FLAG_1, FLAG_2|FLAG_1 + FLAG_2')
+
+
+class InstrumentationTest(TestCase):
+    def test_disabled_by_default(self):
+        self.assertFalse(instrumentation.is_enabled())
+        self.assertFalse(hasattr(BitHandler.__init__, '__wrapped__'))
+
+    def test_instrumented(self):
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO %s (another_name) VALUES (-1)' % BitFieldTestModel._meta.db_table)
+        with instrumentation.instrumented() as stats:
+            self.assertTrue(instrumentation.is_enabled())
+            instance = BitFieldTestModel.objects.get()
+            self.assertTrue(instance.flags.FLAG_0)
+            Bit(100)
+            list(BitFieldTestModel.objects.filter(flags=BitFieldTestModel.flags.FLAG_1))
+        self.assertFalse(instrumentation.is_enabled())
+        self.assertFalse(hasattr(BitField.to_python, '__wrapped__'))
+        self.assertEqual(stats.counts['to_python'], 1)
+        self.assertEqual(stats.counts['handlers'], 1)
+        self.assertEqual(stats.counts['repairs'], 1)
+        self.assertEqual(stats.counts['bits'], 1)
+        self.assertEqual(stats.counts['lookups'], 1)
+        self.assertGreater(stats.timings['to_python'], 0)
+
+    def test_snapshot_and_reset(self):
+        instrumentation.enable()
+        try:
+            instrumentation.reset()
+            BitHandler(0, ('FLAG_0',))
+            with instrumentation.instrumented() as stats:
+                BitHandler(0, ('FLAG_0',))
+            self.assertTrue(instrumentation.is_enabled())
+            self.assertEqual(stats.counts, {'handlers': 1})
+            self.assertEqual(instrumentation.snapshot()['counts'], {'handlers': 2})
+            instrumentation.reset()
+            self.assertEqual(instrumentation.snapshot(), {'counts': {}, 'timings': {}})
+        finally:
+            instrumentation.disable()
+
+    def test_overlapping_threads(self):
+        import threading
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def request(name, handlers):
+            with instrumentation.instrumented() as stats:
+                barrier.wait()
+                for i in range(handlers):
+                    BitHandler(0, ('FLAG_0',))
+                barrier.wait()
+                if name == 'second':
+                    # The first thread has left its block.
+                    barrier.wait()
+                    BitHandler(0, ('FLAG_0',))
+            if name == 'first':
+                barrier.wait()
+            results[name] = stats.counts
+
+        threads = [
+            threading.Thread(target=request, args=('first', 1)),
+            threading.Thread(target=request, args=('second', 2)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {'first': {'handlers': 1}, 'second': {'handlers': 3}})
+        self.assertFalse(instrumentation.is_enabled())
+
+    def test_finished_threads(self):
+        import gc
+        import threading
+
+        def request():
+            with instrumentation.instrumented():
+                BitHandler(0, ('FLAG_0',))
+
+        counts, timings = instrumentation._get_counters()
+        instrumentation.reset()
+        threads = [threading.Thread(target=request) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+        self.assertEqual(instrumentation.snapshot()['counts'], {'handlers': 3})
+        self.assertEqual(list(instrumentation._thread_counters), [id(counts)])
+        instrumentation.reset()
+        self.assertEqual(instrumentation.snapshot()['counts'], {})
+
+
+class ExplainBitFieldsCommandTest(TestCase):
+    def test_parse_plan(self):
+        from bitfield.management.commands.explain_bitfields import parse_plan
+
+        self.assertEqual(parse_plan('sqlite', '2 0 0 SCAN t'), (True, None))
+        self.assertEqual(parse_plan('sqlite', '3 0 0 SEARCH t USING INDEX i (x=?)'), (False, None))
+        self.assertEqual(parse_plan('sqlite', '3 0 0 SCAN t USING INDEX partial'), (False, None))
+        self.assertEqual(
+            parse_plan('postgresql', 'Seq Scan on t  (cost=0.00..35.50 rows=11 width=12)\n  Filter: ...'),
+            (True, 11))
+        self.assertEqual(
+            parse_plan('postgresql', 'Index Scan using i on t  (cost=0.15..8.17 rows=1 width=12)'),
+            (False, 1))
+        self.assertEqual(parse_plan('oracle', '...'), (None, None))
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'explain_bitfields', 'tests.BitFieldTestModel', 'tests.BitFlagIndexTestModel', stdout=out)
+        output = out.getvalue()
+        self.assertIn('tests.BitFieldTestModel.flags', output)
+        self.assertIn("BitFlagIndex('flags', 'FLAG_3'),", output)
+        if connection.vendor == 'sqlite':
+            lines = output.splitlines()
+            self.assertIn('  FLAG_1               set   index      rows=?', lines)
+            self.assertIn('  FLAG_3               set   FULL SCAN  rows=?', lines)
+            # FLAG_0 has a partial index, which only serves it when set.
+            self.assertIn('  FLAG_0               set   index      rows=?', lines)
+            self.assertIn('  FLAG_0               unset FULL SCAN  rows=?', lines)
+            index_model_output = output.split('tests.BitFlagIndexTestModel.flags')[1]
+            self.assertIn("BitFlagIndex('flags', 'FLAG_0')", index_model_output)
+            self.assertNotIn("BitFlagIndex('flags', 'FLAG_1')", index_model_output)
+
+
+class BitFieldStatsCommandTest(TestCase):
+    def setUp(self):
+        for value in (0b0001, 0b0011, 0b0011, 0b0110, 0):
+            BitFieldTestModel.objects.create(flags=value)
+
+    def get_stats(self, *args):
+        out = StringIO()
+        call_command('bitfield_stats', 'tests.BitFieldTestModel', '--json', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_json(self):
+        stats = self.get_stats('--chunk-size', '2', '--top', '2')
+        self.assertEqual(stats['rows'], 5)
+        self.assertEqual(stats['flags'], {'FLAG_0': 3, 'FLAG_1': 3, 'FLAG_2': 1, 'FLAG_3': 0})
+        self.assertEqual(stats['pairs'], [['FLAG_0', 'FLAG_1', 2], ['FLAG_1', 'FLAG_2', 1]])
+        self.assertEqual(stats['top_values'][0], [3, 2, ['FLAG_0', 'FLAG_1']])
+        self.assertEqual(len(stats['top_values']), 2)
+        self.assertFalse(stats['approximate_top_values'])
+
+    def test_sample(self):
+        stats = self.get_stats('--chunk-size', '1', '--sample', '0.5', '--seed', '1')
+        self.assertLess(stats['rows'], 5)
+        self.assertEqual(stats['sample'], 0.5)
+
+    def test_chunks(self):
+        from bitfield.management.commands.bitfield_stats import Command
+
+        field = BitFieldTestModel._meta.get_field('flags')
+        queryset = BitFieldTestModel.objects.all()
+        chunks = list(Command().iter_chunks(queryset, field, 2, 1, None))
+        self.assertEqual(chunks, [[1, 3], [3, 6], [0]])
+        # Sparse keys: one bound and one read query per chunk.
+        BitFieldTestModel.objects.create(id=10 ** 15, flags=8)
+        with self.assertNumQueries(4):
+            chunks = list(Command().iter_chunks(queryset, field, 3, 1, None))
+        self.assertEqual(chunks, [[1, 3, 3], [6, 0, 8]])
+
+    def test_report(self):
+        out = StringIO()
+        call_command('bitfield_stats', 'tests.BitFieldTestModel', 'flags', stdout=out)
+        output = out.getvalue()
+        self.assertIn('tests.BitFieldTestModel.flags: 5 rows', output)
+        self.assertIn('FLAG_0 + FLAG_1', output)
+        self.assertIn('FLAG_0, FLAG_1', output)
+
+
+class RemapBitsTest(TestCase):
+    old_flags = ['FLAG_0', 'FLAG_1', 'FLAG_2', 'FLAG_3']
+    new_flags = ['FLAG_3', 'FLAG_0', 'FLAG_2']
+
+    def get_values(self):
+        return list(BitFieldTestModel.objects.order_by('pk').values_list('flags', flat=True))
+
+    def test_permutation(self):
+        from bitfield.operations import get_bit_permutation, get_remap_expression
+        self.assertEqual(get_bit_permutation(self.old_flags, self.new_flags), {0: 1, 2: 2, 3: 0})
+        self.assertEqual(
+            get_bit_permutation(('a', 'b'), {1: 'c'}, renames={'b': 'c'}), {1: 1})
+        self.assertEqual(
+            get_bit_permutation((('a', 'A label'), 'b'), ('b', 'a')), {0: 1, 1: 0})
+        self.assertEqual(get_remap_expression('flags', {}).value, 0)
+
+    def test_remap_bits(self):
+        from bitfield.operations import remap_bits
+        for value in (1, 2, 4, 8, 15, 0):
+            BitFieldTestModel.objects.create(flags=value)
+        updated = remap_bits(
+            BitFieldTestModel, 'flags', self.old_flags, self.new_flags, batch_size=4)
+        self.assertEqual(updated, 6)
+        self.assertEqual(self.get_values(), [2, 0, 4, 1, 7, 0])
+        # Nothing moved.
+        self.assertEqual(remap_bits(BitFieldTestModel, 'flags', ['a', 'b'], ['a', 'b', 'c']), 0)
+
+    def test_operation(self):
+        from django.apps import apps
+        from django.db.migrations.state import ProjectState
+        from django.db.migrations.writer import MigrationWriter
+        from bitfield.operations import RemapBits
+        for value in (1, 8, 9):
+            BitFieldTestModel.objects.create(flags=value)
+        operation = RemapBits('BitFieldTestModel', 'flags', self.old_flags, self.new_flags)
+        state = ProjectState.from_apps(apps)
+        editor = connection.schema_editor()
+        operation.database_forwards('tests', editor, state, state)
+        self.assertEqual(self.get_values(), [2, 1, 3])
+        operation.database_backwards('tests', editor, state, state)
+        self.assertEqual(self.get_values(), [1, 8, 9])
+
+        self.assertEqual(operation.deconstruct(), ('RemapBits', [], {
+            'model_name': 'BitFieldTestModel', 'name': 'flags',
+            'old_flags': self.old_flags, 'new_flags': self.new_flags,
+        }))
+        string, imports = MigrationWriter.serialize(operation)
+        self.assertIn('bitfield.operations.RemapBits(', string)
+        self.assertIn('import bitfield.operations', imports)
+
+    def get_operations(self, old_flags, new_flags, renames=False):
+        from django.db.migrations.questioner import MigrationQuestioner
+        from django.db.migrations.state import ModelState, ProjectState
+        from bitfield.autodetector import BitFieldAutodetector
+
+        def get_state(flags):
+            state = ProjectState()
+            state.add_model(ModelState('tests', 'Article', [
+                ('id', models.AutoField(primary_key=True)),
+                ('flags', BitField(flags=flags)),
+            ]))
+            return state
+
+        questioner = MigrationQuestioner(defaults={'ask_rename_flag': renames})
+        changes = BitFieldAutodetector(
+            get_state(old_flags), get_state(new_flags), questioner)._detect_changes()
+        return [op for migration in changes.get('tests', []) for op in migration.operations]
+
+    def test_autodetector(self):
+        from django.db.migrations.operations import AlterField
+        from bitfield.operations import RemapBits
+        operations = self.get_operations(('a', 'b', 'c'), ('b', 'c'))
+        self.assertEqual([type(op) for op in operations], [AlterField, RemapBits])
+        self.assertEqual(operations[1].old_flags, ['a', 'b', 'c'])
+        self.assertEqual(operations[1].new_flags, ['b', 'c'])
+        # Replaced in place: renamed only when confirmed.
+        operations = self.get_operations(('a', 'b'), ('a', 'x', 'c'))
+        self.assertEqual([type(op) for op in operations], [AlterField, RemapBits])
+        self.assertEqual(operations[1].renames, {})
+        operations = self.get_operations(('a', 'b'), ('a', 'x', 'c'), renames=True)
+        self.assertEqual([type(op) for op in operations], [AlterField])
+        # Renamed while another flag moves.
+        operations = self.get_operations(('a', 'b', 'c'), ('x', 'c', 'b'), renames=True)
+        self.assertEqual(operations[1].renames, {'a': 'x'})
+
+    def test_autodetector_asks_renames(self):
+        from unittest import mock
+        from django.core.management.base import OutputWrapper
+        from django.db.migrations.questioner import InteractiveMigrationQuestioner
+        from django.db.migrations.state import ProjectState
+        from bitfield.autodetector import BitFieldAutodetector
+
+        output = StringIO()
+        autodetector = BitFieldAutodetector(
+            ProjectState(), ProjectState(),
+            InteractiveMigrationQuestioner(prompt_output=OutputWrapper(output)))
+        with mock.patch('builtins.input', return_value='y'):
+            self.assertTrue(autodetector.ask_flag_rename('article', 'flags', 'a', 'x'))
+        self.assertIn('Was flag a of article.flags renamed to x?', output.getvalue())
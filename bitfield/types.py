@@ -1,18 +1,65 @@
+from functools import lru_cache
+
+
 def cmp(a, b):
     return (a > b) - (a < b)
 
 
+# Number of bit positions for which ``Bit`` instances are interned; this
+# covers every flag a BIGINT column can hold.
+INTERNED_BIT_COUNT = 64
+
+
+try:
+    _bit_count = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _bit_count(value):
+        return bin(value).count('1')
+
+
 class Bit(object):
     """
     Represents a single Bit.
+
+    Bits are immutable; ``Bit(n, is_set)`` for ``0 <= n < 64`` always
+    returns the same shared instance.
     """
-    def __init__(self, number, is_set=True):
-        self.number = number
-        self.is_set = bool(is_set)
-        self.mask = 2 ** int(number)
-        self.children = []
-        if not self.is_set:
-            self.mask = ~self.mask
+    __slots__ = ('number', 'is_set', 'mask')
+
+    children = ()
+
+    def __new__(cls, number, is_set=True):
+        is_set = bool(is_set)
+        if cls is Bit and type(number) is int and 0 <= number < INTERNED_BIT_COUNT:
+            return _BITS[is_set][number]
+        return cls._create(number, is_set)
+
+    @classmethod
+    def _create(cls, number, is_set):
+        self = object.__new__(cls)
+        mask = 1 << int(number)
+        if not is_set:
+            mask = ~mask
+        set_ = object.__setattr__
+        set_(self, 'number', number)
+        set_(self, 'is_set', is_set)
+        set_(self, 'mask', mask)
+        return self
+
+    def __setattr__(self, key, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, key):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __reduce__(self):
+        return (self.__class__, (self.number, self.is_set))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __repr__(self):
         return '<%s: number=%d, is_set=%s>' % (self.__class__.__name__, self.number, self.is_set)
@@ -42,6 +89,10 @@ class Bit(object):
     def __ne__(self, value):
         return not self == value
 
+    def __hash__(self):
+        # Consistent with equality to the integer mask.
+        return hash(self.mask)
+
     def __coerce__(self, value):
         return (self.is_set, bool(value))
 
@@ -108,18 +159,173 @@ class Bit(object):
         return evaluator.prepare_node(self, query, allow_joins)
 
 
+_BITS = (
+    tuple(Bit._create(n, False) for n in range(INTERNED_BIT_COUNT)),
+    tuple(Bit._create(n, True) for n in range(INTERNED_BIT_COUNT)),
+)
+
+
+class BitFieldSchema(object):
+    """
+    Compiled, immutable description of a set of flags.
+
+    Built once per ``BitField`` and shared by every ``BitHandler`` bound to
+    it, so flag lookups are a single dict hit instead of a ``list.index``.
+    """
+    __slots__ = ('keys', 'labels', 'numbers', 'masks', 'mask', '_hash')
+
+    def __init__(self, keys, labels=None):
+        keys = tuple(keys)
+        labels = tuple(labels) if labels is not None else keys
+        numbers = {}
+        for number, key in enumerate(keys):
+            # Keep the first occurrence to match ``keys.index`` semantics.
+            numbers.setdefault(key, number)
+        set_ = object.__setattr__
+        set_(self, 'keys', keys)
+        set_(self, 'labels', labels)
+        set_(self, 'numbers', numbers)
+        set_(self, 'masks', tuple(1 << n for n in range(len(keys))))
+        set_(self, 'mask', (1 << len(keys)) - 1)
+        # Schemas key the label cache, hash them once.
+        set_(self, '_hash', hash((keys, labels)))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, key):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __reduce__(self):
+        return (self.__class__, (self.keys, self.labels))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, ', '.join(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __eq__(self, other):
+        if not isinstance(other, BitFieldSchema):
+            return NotImplemented
+        return self.keys == other.keys and self.labels == other.labels
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+
+# Number of ``(schema, value)`` pairs whose labels are memoized.
+LABEL_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def get_set_labels(schema, value):
+    """
+    Return the tuple of labels of the flags of ``schema`` set in the
+    integer ``value``.
+
+    Results are memoized: a table usually holds few distinct flag values,
+    so rendering them for every row of a listing is a cache hit.
+    """
+    return tuple(
+        label for label, mask in zip(schema.labels, schema.masks)
+        # Unused bits of dict defined fields have empty labels.
+        if value & mask and label
+    )
+
+
+# ``(model label, field name)`` of a field using each schema, so that
+# handlers are pickled as a reference to their field instead of their flags.
+_SCHEMA_REFS = {}
+
+
+def register_schema(schema, model_label, field_name):
+    _SCHEMA_REFS.setdefault(schema, (model_label, field_name))
+
+
+def _load_handler(ref, value, set_mask=0, clear_mask=0):
+    """
+    Unpickle a ``BitHandler`` pickled with a field reference, binding it to
+    the live schema of that field.
+    """
+    from django.apps import apps
+
+    model_label, field_name = ref
+    schema = apps.get_model(model_label)._meta.get_field(field_name).schema
+    handler = BitHandler(value, schema)
+    handler._set_mask = set_mask
+    handler._clear_mask = clear_mask
+    return handler
+
+
 class BitHandler(object):
     """
     Represents an array of bits, each as a ``Bit`` object.
     """
+    __slots__ = ('_value', '_schema', '_set_mask', '_clear_mask', '_row')
+
     def __init__(self, value, keys, labels=None):
         # TODO: change to bitarray?
         if value:
             self._value = int(value)
         else:
             self._value = 0
-        self._keys = keys
-        self._labels = labels is not None and labels or keys
+        if not isinstance(keys, BitFieldSchema):
+            keys = BitFieldSchema(keys, labels)
+        self._schema = keys
+        # Flags set and cleared through ``set_bit``, see ``get_changes``.
+        self._set_mask = 0
+        self._clear_mask = 0
+        # ``(field, pk)`` of the saved row this value was read from.
+        self._row = None
+
+    def __reduce_ex__(self, protocol):
+        ref = _SCHEMA_REFS.get(self._schema)
+        if ref is None:
+            return super(BitHandler, self).__reduce_ex__(protocol)
+        args = (ref, self._value)
+        if self._set_mask or self._clear_mask:
+            args += (self._set_mask, self._clear_mask)
+        return (_load_handler, args)
+
+    def __getstate__(self):
+        return {
+            '_value': self._value,
+            '_schema': self._schema,
+            '_set_mask': self._set_mask,
+            '_clear_mask': self._clear_mask,
+        }
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (dict, slots) state produced by the default slots protocol.
+            state = dict(state[0] or {}, **(state[1] or {}))
+        schema = state.get('_schema')
+        if schema is None:
+            # Pickled before handlers carried a schema.
+            schema = BitFieldSchema(state.get('_keys', ()), state.get('_labels'))
+        self._value = state.get('_value', 0)
+        self._schema = schema
+        self._set_mask = state.get('_set_mask', 0)
+        self._clear_mask = state.get('_clear_mask', 0)
+        self._row = None
+
+    def _get_keys(self):
+        return self._schema.keys
+    _keys = property(_get_keys)
+
+    def _get_labels(self):
+        return self._schema.labels
+    _labels = property(_get_labels)
 
     def __eq__(self, other):
         if not isinstance(other, BitHandler):
@@ -142,7 +348,7 @@ class BitHandler(object):
         return cmp(self._value, other)
 
     def __repr__(self):
-        return '<%s: %s>' % (self.__class__.__name__, ', '.join('%s=%s' % (k, self.get_bit(n).is_set) for n, k in enumerate(self._keys)),)
+        return '<%s: %s>' % (self.__class__.__name__, ', '.join('%s=%s' % (k, self.get_bit(n).is_set) for n, k in enumerate(self._schema.keys)),)
 
     def __str__(self):
         return str(self._value)
@@ -156,43 +362,47 @@ class BitHandler(object):
     __nonzero__ = __bool__
 
     def __and__(self, value):
-        return BitHandler(self._value & int(value), self._keys)
+        return BitHandler(self._value & int(value), self._schema)
 
     def __or__(self, value):
-        return BitHandler(self._value | int(value), self._keys)
+        return BitHandler(self._value | int(value), self._schema)
 
     def __add__(self, value):
-        return BitHandler(self._value + int(value), self._keys)
+        return BitHandler(self._value + int(value), self._schema)
 
     def __sub__(self, value):
-        return BitHandler(self._value - int(value), self._keys)
+        return BitHandler(self._value - int(value), self._schema)
 
     def __lshift__(self, value):
-        return BitHandler(self._value << int(value), self._keys)
+        return BitHandler(self._value << int(value), self._schema)
 
     def __rshift__(self, value):
-        return BitHandler(self._value >> int(value), self._keys)
+        return BitHandler(self._value >> int(value), self._schema)
 
     def __xor__(self, value):
-        return BitHandler(self._value ^ int(value), self._keys)
+        return BitHandler(self._value ^ int(value), self._schema)
 
     def __contains__(self, key):
-        bit_number = self._keys.index(key)
-        return bool(self.get_bit(bit_number))
+        bit_number = self._schema.numbers[key]
+        return bool(self._value & self._schema.masks[bit_number])
 
     def __getattr__(self, key):
         if key.startswith('_'):
             return object.__getattribute__(self, key)
-        if key not in self._keys:
+        try:
+            bit_number = self._schema.numbers[key]
+        except KeyError:
             raise AttributeError('%s is not a valid flag' % key)
-        return self.get_bit(self._keys.index(key))
+        return self.get_bit(bit_number)
 
     def __setattr__(self, key, value):
         if key.startswith('_'):
             return object.__setattr__(self, key, value)
-        if key not in self._keys:
+        try:
+            bit_number = self._schema.numbers[key]
+        except KeyError:
             raise AttributeError('%s is not a valid flag' % key)
-        self.set_bit(self._keys.index(key), value)
+        self.set_bit(bit_number, value)
 
     def __iter__(self):
         return self.iteritems()
@@ -208,36 +418,58 @@ class BitHandler(object):
         return self.mask, []
 
     def get_bit(self, bit_number):
-        mask = 2 ** int(bit_number)
+        mask = 1 << int(bit_number)
         return Bit(bit_number, self._value & mask != 0)
 
     def set_bit(self, bit_number, true_or_false):
-        mask = 2 ** int(bit_number)
+        mask = 1 << int(bit_number)
         if true_or_false:
             self._value |= mask
+            self._set_mask |= mask
+            self._clear_mask &= ~mask
         else:
             self._value &= (~mask)
+            self._clear_mask |= mask
+            self._set_mask &= ~mask
         return Bit(bit_number, self._value & mask != 0)
 
+    def get_changes(self):
+        """
+        Return ``(set_mask, clear_mask)``, the flags set and cleared since
+        the handler was loaded or last saved.
+        """
+        return self._set_mask, self._clear_mask
+
+    def reset_changes(self):
+        self._set_mask = 0
+        self._clear_mask = 0
+
+    def count(self):
+        """
+        Return the number of flags set.
+        """
+        return _bit_count(self._value)
+
     def keys(self):
-        return self._keys
+        return self._schema.keys
 
     def iterkeys(self):
-        return iter(self._keys)
+        return iter(self._schema.keys)
 
     def items(self):
         return list(self.iteritems())
 
     def iteritems(self):
-        for k in self._keys:
-            yield (k, getattr(self, k).is_set)
+        value = self._value
+        for key, mask in zip(self._schema.keys, self._schema.masks):
+            yield (key, value & mask != 0)
 
     def get_label(self, flag):
         if isinstance(flag, str):
-            flag = self._keys.index(flag)
+            flag = self._schema.numbers[flag]
         if isinstance(flag, Bit):
             flag = flag.number
-        return self._labels[flag]
+        return self._schema.labels[flag]
 
 
 from django.core.exceptions import ImproperlyConfigured
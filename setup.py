@@ -38,10 +38,14 @@ setup(
         'Django>=1.11.29',
     ],
     extras_require={
+        'numpy': [
+            'numpy',
+        ],
         'tests': [
             'flake8',
             'mysqlclient',
             'psycopg2>=2.3',
+            'pytest-benchmark',
             'pytest-django',
         ],
     },